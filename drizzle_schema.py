@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Parser for drizzle/schema.ts shared by the migration scripts.
+Tokenizes the file in one pass and matches brackets on the token stream, so
+parsing is linear in the size of the schema and copes with any nesting
+(column options, enum lists, references(() => ...), comments and strings
+containing braces).
+"""
+
+import re
+import bisect
+import json
+import hashlib
+import os
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Optional, Tuple, Any
+
+def camel_to_snake(name: str) -> str:
+    """Convert camelCase to snake_case"""
+    # Insert underscore before uppercase letters
+    s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
+    # Handle consecutive uppercase letters
+    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
+
+@dataclass
+class Column:
+    """One column of a mysqlTable() definition"""
+    name: str                      # property name in schema.ts
+    db_name: str                   # column name in the database: int("colName"), else the property name
+    type: str                      # drizzle builder: int, varchar, mysqlEnum, ...
+    options: Dict[str, Any] = field(default_factory=dict)   # e.g. {"length": 512}
+    enum_values: List[str] = field(default_factory=list)    # mysqlEnum values
+    modifiers: Dict[str, Optional[str]] = field(default_factory=dict)  # chained calls: {"notNull": None, "default": '"en"'}
+    line: int = 0
+
+    @property
+    def not_null(self) -> bool:
+        return "notNull" in self.modifiers or "primaryKey" in self.modifiers
+
+@dataclass
+class Index:
+    """index() / uniqueIndex() of a table"""
+    name: str
+    columns: List[str]             # property names, as in .on(table.col, ...)
+    unique: bool = False
+    line: int = 0
+
+@dataclass
+class Table:
+    """One `export const var = mysqlTable("name", {...}, extras)` definition"""
+    var_name: str
+    name: str
+    columns: List[Column] = field(default_factory=list)
+    indexes: List[Index] = field(default_factory=list)
+    line: int = 0
+
+    def column(self, name: str) -> Optional[Column]:
+        """Column by property name"""
+        for column in self.columns:
+            if column.name == name:
+                return column
+        return None
+
+    def db_column_names(self, names: List[str]) -> List[str]:
+        """Database names for property names (unknown names are kept as is)"""
+        db_names = {column.name: column.db_name for column in self.columns}
+        return [db_names.get(name, name) for name in names]
+
+# Token kinds: string, number, name, punct. Whitespace and comments are dropped.
+_TOKEN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'|`(?:[^`\\]|\\.)*`)
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<name>[A-Za-z_$][\w$]*)
+  | (?P<punct>=>|\.\.\.|.)
+''', re.VERBOSE | re.DOTALL)
+
+_OPENERS = {'(', '[', '{'}
+_CLOSERS = {')', ']', '}'}
+
+def tokenize(source: str) -> List[Tuple[str, str, int]]:
+    """Split TypeScript source into (kind, text, offset) tokens"""
+    tokens = []
+    for match in _TOKEN.finditer(source):
+        kind = match.lastgroup
+        if kind not in ('space', 'comment'):
+            tokens.append((kind, match.group(), match.start()))
+    return tokens
+
+def _string_value(text: str) -> str:
+    """Contents of a string literal token"""
+    return re.sub(r'\\(.)', r'\1', text[1:-1])
+
+class _Parser:
+    """Recursive-descent reader over the token stream of schema.ts"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.tokens = tokenize(source)
+        self.pos = 0
+        self._line_starts = [0] + [match.end() for match in re.finditer('\n', source)]
+
+    def line(self, index: int) -> int:
+        offset = self.tokens[index][2] if index < len(self.tokens) else len(self.source)
+        return bisect.bisect_right(self._line_starts, offset)
+
+    def peek(self, ahead: int = 0) -> Tuple[str, str, int]:
+        index = self.pos + ahead
+        return self.tokens[index] if index < len(self.tokens) else ('eof', '', len(self.source))
+
+    def is_punct(self, text: str, ahead: int = 0) -> bool:
+        kind, token, _ = self.peek(ahead)
+        return kind == 'punct' and token == text
+
+    def accept(self, text: str) -> bool:
+        if self.is_punct(text):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, text: str) -> None:
+        if not self.accept(text):
+            raise SyntaxError(f"schema.ts line {self.line(self.pos)}: expected {text!r}, found {self.peek()[1]!r}")
+
+    def matching(self, index: int) -> int:
+        """Index of the token closing the bracket at token `index`"""
+        depth = 0
+        for i in range(index, len(self.tokens)):
+            kind, text, _ = self.tokens[i]
+            if kind != 'punct':
+                continue
+            if text in _OPENERS:
+                depth += 1
+            elif text in _CLOSERS:
+                depth -= 1
+                if depth == 0:
+                    return i
+        raise SyntaxError(f"schema.ts line {self.line(index)}: unbalanced {self.tokens[index][1]!r}")
+
+    def source_between(self, start: int, end: int) -> str:
+        """Source text of tokens start..end-1"""
+        if end <= start:
+            return ''
+        stop = self.tokens[end][2] if end < len(self.tokens) else len(self.source)
+        return self.source[self.tokens[start][2]:stop].strip()
+
+    def skip_expression(self) -> str:
+        """Skip to the next ',' or unmatched closing bracket; returns the skipped source"""
+        start = self.pos
+        while self.pos < len(self.tokens):
+            kind, text, _ = self.tokens[self.pos]
+            if kind == 'punct':
+                if text in _OPENERS:
+                    self.pos = self.matching(self.pos)
+                elif text in _CLOSERS or text == ',':
+                    break
+            self.pos += 1
+        return self.source_between(start, self.pos)
+
+    def value(self) -> Any:
+        """A literal (string, number, boolean, array, object), else the expression's source text"""
+        kind, text, _ = self.peek()
+        ends_here = self.peek(1)[0] == 'punct' and self.peek(1)[1] in (',', ')', ']', '}')
+        if kind == 'string' and ends_here:
+            self.pos += 1
+            return _string_value(text)
+        if kind == 'number' and ends_here:
+            self.pos += 1
+            return float(text) if '.' in text else int(text)
+        if kind == 'name' and text in ('true', 'false', 'null') and ends_here:
+            self.pos += 1
+            return {'true': True, 'false': False, 'null': None}[text]
+        if self.is_punct('['):
+            self.pos += 1
+            return self.items(']')
+        if self.is_punct('{'):
+            return self.object_literal()
+        return self.skip_expression()
+
+    def items(self, closer: str) -> List[Any]:
+        """Comma separated values after the opening bracket, up to and including closer"""
+        items = []
+        while not self.accept(closer):
+            items.append(self.value())
+            if not self.accept(','):
+                self.expect(closer)
+                break
+        return items
+
+    def object_literal(self) -> Dict[str, Any]:
+        self.expect('{')
+        result = {}
+        while not self.accept('}'):
+            if self.accept('...'):
+                self.skip_expression()
+            else:
+                key = self.property_key()
+                result[key] = self.value() if self.accept(':') else key  # shorthand property
+            if not self.accept(','):
+                self.expect('}')
+                break
+        return result
+
+    def property_key(self) -> str:
+        kind, text, _ = self.peek()
+        self.pos += 1
+        return _string_value(text) if kind == 'string' else text
+
+    def column(self, name: str) -> Optional[Column]:
+        """`type("db_name", {options}).modifier(...)...`, or None if not a column builder"""
+        line = self.line(self.pos)
+        kind, builder, _ = self.peek()
+        if kind != 'name' or not self.is_punct('(', 1):
+            self.skip_expression()
+            return None
+        self.pos += 2
+        args = self.items(')')
+        column = Column(name=name, db_name=name, type=builder, line=line)
+        if args and isinstance(args[0], str):
+            column.db_name = args.pop(0)
+        for arg in args:
+            if isinstance(arg, dict):
+                column.options.update(arg)
+            elif isinstance(arg, list):
+                column.enum_values = [value for value in arg if isinstance(value, str)]
+
+        while self.accept('.'):
+            method = self.peek()[1]
+            self.pos += 1
+            argument = None
+            if self.is_punct('('):
+                close = self.matching(self.pos)
+                argument = self.source_between(self.pos + 1, close) or None
+                self.pos = close + 1
+            column.modifiers[method] = argument
+        self.skip_expression()
+        return column
+
+    def indexes(self, end: int) -> List[Index]:
+        """index("name").on(table.a, ...) / uniqueIndex(...) calls before token `end`"""
+        found = []
+        while self.pos < end:
+            kind, text, _ = self.peek()
+            if not (kind == 'name' and text in ('index', 'uniqueIndex') and self.is_punct('(', 1)):
+                self.pos += 1
+                continue
+            index = Index(name='', columns=[], unique=text == 'uniqueIndex', line=self.line(self.pos))
+            self.pos += 2
+            args = self.items(')')
+            if args and isinstance(args[0], str):
+                index.name = args[0]
+            if self.is_punct('.') and self.peek(1)[1] == 'on' and self.is_punct('(', 2):
+                close = self.matching(self.pos + 2)
+                # Column references: table.col, whatever the callback parameter is called
+                for i in range(self.pos + 3, close - 1):
+                    if self.tokens[i][0:2] == ('punct', '.') and self.tokens[i + 1][0] == 'name':
+                        index.columns.append(self.tokens[i + 1][1])
+                self.pos = close + 1
+            found.append(index)
+        return found
+
+    def is_table_start(self) -> bool:
+        """`export const name = mysqlTable("table", ...`"""
+        return (self.peek()[1] == 'export' and self.peek(1)[1] == 'const' and self.peek(2)[0] == 'name'
+                and self.is_punct('=', 3) and self.peek(4)[1] == 'mysqlTable'
+                and self.is_punct('(', 5) and self.peek(6)[0] == 'string')
+
+    def tables(self) -> List[Table]:
+        tables = []
+        while self.pos < len(self.tokens):
+            if not self.is_table_start():
+                self.pos += 1
+                continue
+            table = Table(var_name=self.peek(2)[1], name=_string_value(self.peek(6)[1]),
+                          line=self.line(self.pos))
+            call_end = self.matching(self.pos + 5)
+            self.pos += 7
+            self.expect(',')
+            self.expect('{')
+            while not self.accept('}'):
+                column = None
+                if self.is_punct(':', 1):
+                    key = self.property_key()
+                    self.expect(':')
+                    column = self.column(key)
+                else:
+                    self.skip_expression()  # spread or anything that is not `key: builder(...)`
+                if column is not None:
+                    table.columns.append(column)
+                if not self.accept(','):
+                    self.expect('}')
+                    break
+            # Everything after the columns object: (table) => ({ ... }) / [ ... ]
+            table.indexes = self.indexes(call_end)
+            self.pos = call_end + 1
+            tables.append(table)
+        return tables
+
+def parse_schema(source: str) -> List[Table]:
+    """All mysqlTable() definitions in schema.ts source, in file order"""
+    return _Parser(source).tables()
+
+def load_schema(schema_path: str) -> List[Table]:
+    """Parse a schema.ts file"""
+    with open(schema_path, 'r') as f:
+        return parse_schema(f.read())
+
+# Bumped when the snapshot layout changes; older snapshots trigger a full run
+SNAPSHOT_VERSION = 2
+
+def table_hash(table: Table) -> str:
+    """Content hash of a table definition (ignores line numbers and formatting)"""
+    definition = asdict(table)
+    definition.pop('line')
+    for item in definition['columns'] + definition['indexes']:
+        item.pop('line')
+    encoded = json.dumps(definition, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+def load_snapshot(snapshot_path: str) -> Dict[str, Any]:
+    """
+    Snapshot written by save_snapshot: {"settings": {...}, "tables": {table_name:
+    {"hash": ..., "renames": [[old, new], ...]}}}. Snapshots of older versions
+    have no settings, so they never match and the next run is a full one.
+    """
+    if not os.path.exists(snapshot_path):
+        return {}
+    with open(snapshot_path, 'r') as f:
+        snapshot = json.load(f)
+    if snapshot.get('schema_version') != SNAPSHOT_VERSION:
+        return {'settings': {}, 'tables': {}}
+    return {'settings': snapshot.get('settings', {}), 'tables': snapshot.get('tables', {})}
+
+def save_snapshot(snapshot_path: str, tables: List[Table],
+                  tables_columns: Dict[str, List[Tuple[str, str]]],
+                  previous: Dict[str, Dict[str, Any]], settings: Dict[str, Any]) -> None:
+    """
+    Record the hash of the migrated tables, the renames generated so far and
+    the settings (dialect, mode) they were generated with. Pass only the
+    tables the migration covers, so a table that joins it later counts as new.
+    Renames of earlier runs are kept, so a later delta never repeats them.
+    """
+    snapshot = {}
+    for table in tables:
+        renames = [list(rename) for rename in previous.get(table.name, {}).get('renames', [])]
+        renames += [list(rename) for rename in tables_columns.get(table.name, []) if list(rename) not in renames]
+        snapshot[table.name] = {'hash': table_hash(table), 'renames': renames}
+    tmp_path = snapshot_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'schema_version': SNAPSHOT_VERSION, 'settings': settings, 'tables': snapshot},
+                  f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.replace(tmp_path, snapshot_path)
+
+def incremental_path(sql_path: str) -> str:
+    """Where the delta of an incremental run goes: x.sql -> x.incremental.sql"""
+    root, ext = os.path.splitext(sql_path)
+    return f"{root}.incremental{ext}"
+
+def schema_delta(tables: List[Table], tables_columns: Dict[str, List[Tuple[str, str]]],
+                 snapshot: Dict[str, Dict[str, Any]]) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    Renames of tables that are new or changed since the snapshot, minus the
+    renames the snapshot already generated for them
+    """
+    delta = {}
+    for table in tables:
+        previous = snapshot.get(table.name)
+        if previous is not None and previous.get('hash') == table_hash(table):
+            continue
+        applied = {tuple(rename) for rename in (previous or {}).get('renames', [])}
+        renames = [rename for rename in tables_columns.get(table.name, []) if tuple(rename) not in applied]
+        if renames:
+            delta[table.name] = renames
+    return delta
+
+DIALECTS = ('postgres', 'mysql')
+
+def _timing_start(dialect: str) -> str:
+    if dialect == 'mysql':
+        return "SET @migration_started = NOW(6);"
+    return "SELECT set_config('migration.started', clock_timestamp()::text, false);"
+
+def _timing_end(dialect: str, table_name: str) -> str:
+    if dialect == 'mysql':
+        return (f"SELECT '{table_name}' AS migrated_table, "
+                f"TIMESTAMPDIFF(MICROSECOND, @migration_started, NOW(6)) / 1000 AS elapsed_ms;")
+    return (f"SELECT '{table_name}' AS migrated_table, "
+            f"clock_timestamp() - current_setting('migration.started')::timestamptz AS elapsed;")
+
+def rename_statements(table_name: str, renames: List[Tuple[str, str]], dialect: str = 'postgres',
+                      per_table: bool = False, timing: bool = False) -> List[str]:
+    """
+    RENAME COLUMN statements for one table, as SQL lines.
+    per_table: on MySQL all renames become one multi-clause ALTER TABLE (one
+    metadata lock and round trip per table). PostgreSQL cannot combine RENAME
+    COLUMN clauses, so there the renames run in one transaction per table,
+    which takes the table lock once and holds it.
+    timing: bracket the table with statements that report the elapsed time.
+    """
+    if dialect not in DIALECTS:
+        raise ValueError(f"Unknown SQL dialect: {dialect}")
+    lines = []
+    if timing:
+        lines.append(_timing_start(dialect))
+    if per_table and dialect == 'mysql':
+        clauses = ",\n".join(f"  RENAME COLUMN {old} TO {new}" for old, new in renames)
+        lines.append(f"ALTER TABLE {table_name}\n{clauses};")
+    else:
+        if per_table:
+            lines.append("BEGIN;")
+        lines.extend(f"ALTER TABLE {table_name} RENAME COLUMN {old} TO {new};" for old, new in renames)
+        if per_table:
+            lines.append("COMMIT;")
+    if timing:
+        lines.append(_timing_end(dialect, table_name))
+    return lines
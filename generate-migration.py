@@ -2,65 +2,56 @@
 """
 Generate SQL migration scripts to convert camelCase columns to snake_case in Supabase.
 Analyzes drizzle/schema.ts and generates ALTER TABLE statements.
+The complete migration is rewritten on every run; after the first run the
+renames of tables changed since the saved snapshot also go to *.incremental.sql
+(--full starts the snapshot over).
 """
 
-import re
+import argparse
 from typing import List, Tuple, Dict
 
-def camel_to_snake(name: str) -> str:
-    """Convert camelCase to snake_case"""
-    # Insert underscore before uppercase letters
-    s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-    # Handle consecutive uppercase letters
-    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
+from drizzle_schema import (DIALECTS, Table, camel_to_snake, load_schema, load_snapshot,
+                            incremental_path, rename_statements, save_snapshot, schema_delta)
 
-def extract_columns_from_schema(schema_path: str) -> Dict[str, List[Tuple[str, str]]]:
+# Per-table hashes of the schema as of the last run; only changed tables go to the incremental files
+SNAPSHOT_PATH = 'supabase-migration.snapshot.json'
+
+def extract_columns(tables: List[Table]) -> Dict[str, List[Tuple[str, str]]]:
     """
-    Extract table definitions and their columns from schema.ts
+    Extract the columns to rename from parsed table definitions
     Returns: {table_name: [(column_camel, column_snake), ...]}
     """
-    with open(schema_path, 'r') as f:
-        content = f.read()
-    
     tables_columns = {}
-    
-    # Find all table definitions
-    # Pattern: export const varName = mysqlTable("table_name", {
-    table_pattern = r'export const \w+ = mysqlTable\("(\w+)",\s*\{([^}]+(?:\{[^}]*\}[^}]*)*)\}'
-    
-    for match in re.finditer(table_pattern, content, re.DOTALL):
-        table_name = match.group(1)
-        columns_block = match.group(2)
-        
-        # Extract column definitions
-        # Pattern: columnName: type("columnDbName", ...)
-        column_pattern = r'(\w+):\s*(?:int|varchar|text|timestamp|boolean|decimal|mysqlEnum|json)\('
-        
+
+    for table in tables:
         columns_to_migrate = []
-        
-        for col_match in re.finditer(column_pattern, columns_block):
-            column_var = col_match.group(1)
-            
-            # Check if this is actually a column definition (not a method like 'on')
-            if column_var in ['on', 'set', 'where', 'from', 'to']:
-                continue
-                
-            # Convert to snake_case
-            column_snake = camel_to_snake(column_var)
-            
-            # Only add if conversion actually changes the name (i.e., it was camelCase)
-            if column_var != column_snake:
-                columns_to_migrate.append((column_var, column_snake))
-        
+
+        for column in table.columns:
+            # Rename the column as it exists in the database: int("colName") or the property name
+            column_snake = camel_to_snake(column.db_name)
+
+            # Only add if conversion actually changes the name
+            if column.db_name != column_snake:
+                columns_to_migrate.append((column.db_name, column_snake))
+
         if columns_to_migrate:
-            tables_columns[table_name] = columns_to_migrate
-    
+            tables_columns[table.name] = columns_to_migrate
+
     return tables_columns
 
-def generate_migration_sql(tables_columns: Dict[str, List[Tuple[str, str]]]) -> str:
+def extract_columns_from_schema(schema_path: str) -> Dict[str, List[Tuple[str, str]]]:
+    """Extract camelCase columns of every table in schema.ts"""
+    return extract_columns(load_schema(schema_path))
+
+def generate_migration_sql(tables_columns: Dict[str, List[Tuple[str, str]]], incremental: bool = False,
+                           dialect: str = 'postgres', per_table: bool = False, timing: bool = False) -> str:
     """Generate ALTER TABLE statements for all camelCase columns"""
     sql_lines = []
     sql_lines.append("-- Supabase Schema Migration: Convert camelCase columns to snake_case")
+    if incremental:
+        sql_lines.append("-- INCREMENTAL: only tables changed since the last schema snapshot")
+    if per_table:
+        sql_lines.append(f"-- MODE: one {'ALTER TABLE' if dialect == 'mysql' else 'transaction'} per table ({dialect})")
     sql_lines.append("-- Generated automatically from drizzle/schema.ts")
     sql_lines.append("-- Execute these statements in Supabase SQL Editor")
     sql_lines.append("")
@@ -77,17 +68,21 @@ def generate_migration_sql(tables_columns: Dict[str, List[Tuple[str, str]]]) ->
         columns = tables_columns[table_name]
         sql_lines.append(f"-- Table: {table_name} ({len(columns)} columns)")
         
-        for camel, snake in columns:
-            sql_lines.append(f"ALTER TABLE {table_name} RENAME COLUMN {camel} TO {snake};")
+        sql_lines.extend(rename_statements(table_name, columns, dialect, per_table, timing))
         
         sql_lines.append("")
     
     return "\n".join(sql_lines)
 
-def generate_rollback_sql(tables_columns: Dict[str, List[Tuple[str, str]]]) -> str:
+def generate_rollback_sql(tables_columns: Dict[str, List[Tuple[str, str]]], incremental: bool = False,
+                          dialect: str = 'postgres', per_table: bool = False, timing: bool = False) -> str:
     """Generate rollback statements (snake_case back to camelCase)"""
     sql_lines = []
     sql_lines.append("-- Supabase Schema Rollback: Revert snake_case columns to camelCase")
+    if incremental:
+        sql_lines.append("-- INCREMENTAL: only tables changed since the last schema snapshot")
+    if per_table:
+        sql_lines.append(f"-- MODE: one {'ALTER TABLE' if dialect == 'mysql' else 'transaction'} per table ({dialect})")
     sql_lines.append("-- Use this if you need to undo the migration")
     sql_lines.append("")
     sql_lines.append("-- WARNING: This will rename columns back to their original names.")
@@ -97,38 +92,72 @@ def generate_rollback_sql(tables_columns: Dict[str, List[Tuple[str, str]]]) -> s
         columns = tables_columns[table_name]
         sql_lines.append(f"-- Table: {table_name}")
         
-        for camel, snake in columns:
-            sql_lines.append(f"ALTER TABLE {table_name} RENAME COLUMN {snake} TO {camel};")
+        reverse = [(snake, camel) for camel, snake in columns]
+        sql_lines.extend(rename_statements(table_name, reverse, dialect, per_table, timing))
         
         sql_lines.append("")
     
     return "\n".join(sql_lines)
 
 def main():
+    parser = argparse.ArgumentParser(description='Generate snake_case migration SQL for every table in drizzle/schema.ts')
+    parser.add_argument('--full', action='store_true',
+                        help='ignore the snapshot and write no incremental files')
+    parser.add_argument('--snapshot', default=SNAPSHOT_PATH,
+                        help=f'schema snapshot file (default: {SNAPSHOT_PATH})')
+    parser.add_argument('--dialect', choices=DIALECTS, default='postgres',
+                        help='SQL dialect of the target database (default: postgres)')
+    parser.add_argument('--per-table', action='store_true',
+                        help='one ALTER TABLE per table on MySQL, one transaction per table on PostgreSQL')
+    parser.add_argument('--timing', action='store_true',
+                        help='report the elapsed time of every table while the migration runs')
+    args = parser.parse_args()
+    
     schema_path = 'drizzle/schema.ts'
     
     print("Analyzing schema...")
-    tables_columns = extract_columns_from_schema(schema_path)
+    tables = load_schema(schema_path)
+    all_columns = extract_columns(tables)
     
-    if not tables_columns:
+    if not all_columns:
         print("No camelCase columns found. All columns are already snake_case!")
         return
     
-    print(f"Found {len(tables_columns)} tables with camelCase columns")
-    print(f"Total columns to migrate: {sum(len(cols) for cols in tables_columns.values())}")
+    # The snapshot only tells which renames a migration already covers if it was generated the same way
+    settings = {'dialect': args.dialect, 'per_table': args.per_table, 'timing': args.timing}
+    snapshot = {} if args.full else load_snapshot(args.snapshot)
+    incremental = bool(snapshot.get('tables')) and snapshot['settings'] == settings
+    if snapshot and not incremental:
+        print(f"{args.snapshot} was generated with other settings or an older version; generating every rename.")
+    previous = snapshot['tables'] if incremental else {}
+    tables_columns = schema_delta(tables, all_columns, previous) if incremental else all_columns
+    
+    print(f"Found {len(all_columns)} tables with camelCase columns")
+    print(f"Total columns to migrate: {sum(len(cols) for cols in all_columns.values())}")
     print()
     
-    # Generate migration SQL
-    migration_sql = generate_migration_sql(tables_columns)
-    with open('supabase-migration.sql', 'w') as f:
-        f.write(migration_sql)
-    print("✓ Generated: supabase-migration.sql")
+    # The complete migration is always rewritten; an incremental run writes its delta next to it
+    outputs = [('supabase-migration.sql', generate_migration_sql),
+               ('supabase-rollback.sql', generate_rollback_sql)]
+    for sql_path, generate_sql in outputs:
+        with open(sql_path, 'w') as f:
+            f.write(generate_sql(all_columns, False, args.dialect, args.per_table, args.timing))
+        print(f"✓ Generated: {sql_path}")
     
-    # Generate rollback SQL
-    rollback_sql = generate_rollback_sql(tables_columns)
-    with open('supabase-rollback.sql', 'w') as f:
-        f.write(rollback_sql)
-    print("✓ Generated: supabase-rollback.sql")
+    if incremental and tables_columns:
+        print(f"Incremental run against {args.snapshot} (use --full to regenerate everything)")
+        for sql_path, generate_sql in outputs:
+            with open(incremental_path(sql_path), 'w') as f:
+                f.write(generate_sql(tables_columns, True, args.dialect, args.per_table, args.timing))
+            print(f"✓ Generated: {incremental_path(sql_path)}")
+    elif incremental:
+        print(f"No schema changes since {args.snapshot}; {incremental_path('supabase-migration.sql')} left as is.")
+    
+    save_snapshot(args.snapshot, tables, all_columns, previous, settings)
+    print(f"✓ Updated snapshot: {args.snapshot}")
+    
+    if incremental and not tables_columns:
+        return
     
     # Generate summary report
     print("\nMigration Summary:")
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Suggest indexes for columns the server code filters or sorts on.
+Scans server/**/*.ts (tests excluded) for drizzle predicates (eq(table.col, ...), inArray,
+gte, like, ..., orderBy(desc(table.col))), cross-references the columns with
+the indexes declared in drizzle/schema.ts and ranks the unindexed ones by
+usage. Equality filters combined in one where(), in query order and followed
+by a range filter or else the orderBy() column, are also suggested as
+composite indexes. Candidate CREATE INDEX statements are written to
+add-indexes-suggested.sql; TEXT columns get a prefix length on MySQL and
+json columns are left out.
+"""
+
+import argparse
+import bisect
+import glob
+import os
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import List, Tuple, Dict, Optional, Set
+
+from drizzle_schema import DIALECTS, Column, Table, camel_to_snake, load_schema, tokenize
+
+# Drizzle operators whose column argument ends up in a WHERE / JOIN condition
+FILTER_FUNCTIONS = {'eq', 'ne', 'gt', 'gte', 'lt', 'lte', 'inArray', 'notInArray', 'like', 'ilike',
+                    'notLike', 'notIlike', 'isNull', 'isNotNull', 'between', 'notBetween'}
+# Filters an index can serve as an equality prefix of a composite index
+EQUALITY_FUNCTIONS = {'eq', 'inArray'}
+# Filters an index can serve with the column right after the equality prefix
+RANGE_FUNCTIONS = {'gt', 'gte', 'lt', 'lte', 'between'}
+SORT_FUNCTIONS = {'asc', 'desc'}
+# MySQL indexes TEXT columns only up to a prefix length; 191 characters keeps
+# a utf8mb4 key within InnoDB's 767-byte limit
+TEXT_TYPES = {'text', 'tinytext', 'mediumtext', 'longtext'}
+TEXT_PREFIX_LENGTH = 191
+# Column types a plain B-tree index cannot be built on
+UNINDEXABLE_TYPES = {'json'}
+
+@dataclass
+class Usage:
+    """How often a column (or column list) is filtered / sorted on"""
+    filters: int = 0
+    sorts: int = 0
+    locations: List[str] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return self.filters + self.sorts
+
+class _Source:
+    """Tokens of one TypeScript file with precomputed bracket matches"""
+
+    def __init__(self, path: str, text: str):
+        self.path = path
+        self.text = text
+        self.tokens = tokenize(text)
+        self.close = {}
+        stack = []
+        for i, (kind, token, _) in enumerate(self.tokens):
+            if kind != 'punct':
+                continue
+            if token in '([{':
+                stack.append(i)
+            elif token in ')]}' and stack:
+                self.close[stack.pop()] = i
+        self._line_starts = [0] + [match.end() for match in re.finditer('\n', text)]
+
+    def location(self, index: int) -> str:
+        offset = self.tokens[index][2]
+        return f"{self.path}:{bisect.bisect_right(self._line_starts, offset)}"
+
+    def is_call(self, index: int, names: Set[str]) -> bool:
+        """`name(` at token index (not a property access like foo.eq()"""
+        kind, token, _ = self.tokens[index]
+        return (kind == 'name' and token in names and index + 1 < len(self.tokens)
+                and self.tokens[index + 1][1] == '(' and index + 1 in self.close
+                and (index == 0 or self.tokens[index - 1][1] != '.'))
+
+    def arguments(self, open_index: int) -> List[Tuple[int, int]]:
+        """Token ranges [start, end) of the top-level arguments of the call opened at open_index"""
+        ranges = []
+        start = open_index + 1
+        end = self.close[open_index]
+        i = start
+        while i < end:
+            kind, token, _ = self.tokens[i]
+            if kind == 'punct' and token in '([{' and i in self.close:
+                i = self.close[i]
+            elif kind == 'punct' and token == ',':
+                ranges.append((start, i))
+                start = i + 1
+            i += 1
+        if start < end:
+            ranges.append((start, end))
+        return ranges
+
+    def column_ref(self, start: int, end: int) -> Optional[Tuple[str, str]]:
+        """(table_var, property) when the range is exactly `var.prop`"""
+        if end - start != 3:
+            return None
+        (k1, var, _), (_, dot, _), (k3, prop, _) = self.tokens[start:end]
+        return (var, prop) if k1 == 'name' and dot == '.' and k3 == 'name' else None
+
+def import_aliases(text: str) -> Dict[str, str]:
+    """`import { a as b } from ".../schema"`: local name -> exported table variable"""
+    aliases = {}
+    for match in re.finditer(r'import\s*(?:type\s*)?\{([^}]*)\}\s*from\s*["\'][^"\']*schema["\']', text):
+        for name in match.group(1).split(','):
+            parts = name.split()
+            if len(parts) == 3 and parts[1] == 'as':
+                aliases[parts[2]] = parts[0]
+    return aliases
+
+class Advisor:
+    """Collects column usage from source files against the parsed schema"""
+
+    def __init__(self, tables: List[Table]):
+        self.tables = {table.var_name: table for table in tables}
+        self.columns: Dict[Tuple[str, str], Usage] = defaultdict(Usage)
+        # (table var, sorted equality columns, range or sort column or None)
+        self.composites: Dict[Tuple[str, Tuple[str, ...], Optional[str]], Usage] = defaultdict(Usage)
+        # Equality columns of each composite in the order the first query using it lists them
+        self.composite_order: Dict[Tuple[str, Tuple[str, ...], Optional[str]], Tuple[str, ...]] = {}
+
+    def resolve(self, ref: Optional[Tuple[str, str]], aliases: Dict[str, str]) -> Optional[Tuple[str, str]]:
+        """(table var, column property) for a schema column reference, else None"""
+        if ref is None:
+            return None
+        var, prop = ref
+        table = self.tables.get(aliases.get(var, var))
+        if table is None or table.column(prop) is None:
+            return None
+        return table.var_name, prop
+
+    def scan(self, path: str) -> None:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        source = _Source(path, text)
+        aliases = import_aliases(text)
+        for i in range(len(source.tokens)):
+            if source.is_call(i, FILTER_FUNCTIONS):
+                for start, end in source.arguments(i + 1):
+                    column = self.resolve(source.column_ref(start, end), aliases)
+                    if column:
+                        usage = self.columns[column]
+                        usage.filters += 1
+                        usage.locations.append(source.location(i))
+            elif source.is_call(i, SORT_FUNCTIONS) or self._bare_order_by(source, i):
+                ranges = source.arguments(i + 1)
+                if source.tokens[i][1] in SORT_FUNCTIONS:
+                    ranges = ranges[:1]
+                for start, end in ranges:
+                    column = self.resolve(source.column_ref(start, end), aliases)
+                    if column:
+                        usage = self.columns[column]
+                        usage.sorts += 1
+                        usage.locations.append(source.location(i))
+            if source.is_call(i, {'where'}) or self._method_call(source, i, 'where'):
+                self._scan_where(source, i, aliases)
+
+    @staticmethod
+    def _method_call(source: _Source, i: int, name: str) -> bool:
+        """`.name(`"""
+        return (source.tokens[i][1] == name and i > 0 and source.tokens[i - 1][1] == '.'
+                and i + 1 < len(source.tokens) and source.tokens[i + 1][1] == '(' and i + 1 in source.close)
+
+    def _bare_order_by(self, source: _Source, i: int) -> bool:
+        return self._method_call(source, i, 'orderBy')
+
+    def _scan_where(self, source: _Source, i: int, aliases: Dict[str, str]) -> None:
+        """
+        Equality columns of one where(), followed by its first range column or
+        else a following orderBy column, as a composite candidate
+        """
+        close = source.close[i + 1]
+        equalities: Dict[str, List[str]] = defaultdict(list)
+        ranges: Dict[str, List[str]] = defaultdict(list)
+        for j in range(i + 2, close):
+            for functions, found in ((EQUALITY_FUNCTIONS, equalities), (RANGE_FUNCTIONS, ranges)):
+                if source.is_call(j, functions):
+                    for start, end in source.arguments(j + 1)[:1]:
+                        column = self.resolve(source.column_ref(start, end), aliases)
+                        if column and column[1] not in found[column[0]]:
+                            found[column[0]].append(column[1])
+        # .where(...).orderBy(desc(t.col)) in the same chain
+        sort_columns: Dict[str, str] = {}
+        j = close + 1
+        while j + 2 < len(source.tokens) and source.tokens[j][1] == '.' and source.tokens[j + 2][1] == '(':
+            if j + 2 not in source.close:
+                break
+            if source.tokens[j + 1][1] == 'orderBy':
+                for start, end in source.arguments(j + 2)[:1]:
+                    if end - start > 1 and source.tokens[start][1] in SORT_FUNCTIONS:
+                        start, end = start + 2, end - 1
+                    column = self.resolve(source.column_ref(start, end), aliases)
+                    if column:
+                        sort_columns[column[0]] = column[1]
+                break
+            j = source.close[j + 2] + 1
+        for var, columns in equalities.items():
+            # Past a range condition the index order no longer matches the sort order
+            trailing = next((column for column in ranges[var] if column not in columns), None)
+            sort = sort_columns.get(var)
+            if trailing is None and sort not in columns:
+                trailing = sort
+            if len(columns) + (trailing is not None) > 1:
+                key = (var, tuple(sorted(columns)), trailing)
+                self.composite_order.setdefault(key, tuple(columns))
+                usage = self.composites[key]
+                usage.filters += 1
+                if trailing is not None and trailing == sort:
+                    usage.sorts += 1
+                usage.locations.append(source.location(i))
+
+def is_unique_key(column: Column) -> bool:
+    return 'primaryKey' in column.modifiers or 'unique' in column.modifiers
+
+def indexed_prefixes(table: Table, existing: Dict[str, List[List[str]]]) -> List[List[str]]:
+    """Column lists (database names) of every index on the table, primary key and unique columns included"""
+    prefixes = [table.db_column_names(index.columns) for index in table.indexes]
+    prefixes += [[column.db_name] for column in table.columns if is_unique_key(column)]
+    prefixes += existing.get(table.name, [])
+    return prefixes
+
+def is_covered(columns: List[str], prefixes: List[List[str]], equality_count: int) -> bool:
+    """An index covers the columns when they form its leading columns (equality part in any order)"""
+    for prefix in prefixes:
+        if len(prefix) < len(columns):
+            continue
+        if (set(prefix[:equality_count]) == set(columns[:equality_count])
+                and prefix[equality_count:len(columns)] == columns[equality_count:]):
+            return True
+    return False
+
+def load_existing_indexes(paths: List[str]) -> Dict[str, List[List[str]]]:
+    """CREATE INDEX statements of already applied SQL files: {table: [[col, ...], ...]}"""
+    existing = defaultdict(list)
+    pattern = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?[`"\w]+\s+ON\s+[`"]?(\w+)[`"]?\s*'
+                         r'\(((?:[^()]|\(\d+\))*)\)', re.IGNORECASE)
+    for path in paths:
+        with open(path, 'r') as f:
+            for match in pattern.finditer(f.read()):
+                # `col(191)` is a prefix of a TEXT column
+                columns = [re.sub(r'\(\d+\)$', '', name.strip().split()[0]).strip('`"')
+                           for name in match.group(2).split(',') if name.strip()]
+                existing[match.group(1)].append(columns)
+    return existing
+
+def column_types(table: Table, columns: List[str]) -> List[str]:
+    """Drizzle builder of each database column name"""
+    types = {column.db_name: column.type for column in table.columns}
+    return [types.get(column, '') for column in columns]
+
+def create_index_sql(table: Table, columns: List[str], snake_case: bool, dialect: str = 'mysql') -> str:
+    types = column_types(table, columns)
+    if snake_case:
+        columns = [camel_to_snake(column) for column in columns]
+    name = f"idx_{table.name}_{'_'.join(columns)}"
+    keys = [f"{column}({TEXT_PREFIX_LENGTH})" if dialect == 'mysql' and column_type in TEXT_TYPES else column
+            for column, column_type in zip(columns, types)]
+    return f"CREATE INDEX IF NOT EXISTS {name} ON {table.name}({', '.join(keys)});"
+
+def main():
+    parser = argparse.ArgumentParser(description='Suggest indexes for columns filtered or sorted on in server code')
+    parser.add_argument('--schema', default='drizzle/schema.ts', help='drizzle schema (default: drizzle/schema.ts)')
+    parser.add_argument('--source', default='server', help='directory scanned for **/*.ts (default: server)')
+    parser.add_argument('--existing', nargs='*', default=[], metavar='SQL',
+                        help='SQL files with indexes already applied, e.g. add-indexes-manus.sql')
+    parser.add_argument('--min-uses', type=int, default=2, help='ignore columns used fewer times (default: 2)')
+    parser.add_argument('--snake-case', action='store_true',
+                        help='emit snake_case column names (database after the snake_case migration)')
+    parser.add_argument('--dialect', choices=DIALECTS,
+                        help='SQL dialect of the target database, for TEXT prefix lengths '
+                             '(default: postgres with --snake-case, else mysql)')
+    parser.add_argument('--output', default='add-indexes-suggested.sql',
+                        help='file for the CREATE INDEX statements (default: add-indexes-suggested.sql)')
+    args = parser.parse_args()
+    dialect = args.dialect or ('postgres' if args.snake_case else 'mysql')
+
+    tables = load_schema(args.schema)
+    advisor = Advisor(tables)
+    paths = sorted(path for path in glob.glob(os.path.join(args.source, '**', '*.ts'), recursive=True)
+                   if not path.endswith(('.d.ts', '.test.ts')))
+    for path in paths:
+        advisor.scan(path)
+    existing = load_existing_indexes(args.existing)
+
+    print(f"Scanned {len(paths)} files, {len(tables)} tables, "
+          f"{sum(len(table.indexes) for table in tables)} declared indexes")
+    print()
+
+    # (uses, table, database columns, usage, composite?)
+    candidates = []
+    for (var, prop), usage in advisor.columns.items():
+        table = advisor.tables[var]
+        columns = table.db_column_names([prop])
+        if usage.total >= args.min_uses and not is_covered(columns, indexed_prefixes(table, existing), 1):
+            candidates.append((usage.total, table, columns, usage, False))
+    for key, usage in advisor.composites.items():
+        var, equalities, trailing = key
+        table = advisor.tables[var]
+        if any(is_unique_key(table.column(prop)) for prop in equalities):
+            continue  # already a single-row lookup
+        columns = table.db_column_names(list(advisor.composite_order[key]) + ([trailing] if trailing else []))
+        if usage.filters >= args.min_uses and not is_covered(columns, indexed_prefixes(table, existing), len(equalities)):
+            candidates.append((usage.filters, table, columns, usage, True))
+    unindexable = [f"{table.name}({', '.join(columns)})" for _, table, columns, _, _ in candidates
+                   if set(column_types(table, columns)) & UNINDEXABLE_TYPES]
+    candidates = [candidate for candidate in candidates
+                  if not set(column_types(candidate[1], candidate[2])) & UNINDEXABLE_TYPES]
+    if unindexable:
+        print(f"Skipped {len(unindexable)} candidate(s) on {'/'.join(sorted(UNINDEXABLE_TYPES))} columns: "
+              f"{', '.join(sorted(unindexable))}")
+        print()
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1].name, candidate[2]))
+
+    if not candidates:
+        print("Every column used at least "
+              f"{args.min_uses} times in filters or sorts is covered by an index.")
+        return
+
+    print(f"{'uses':>5} {'filter':>6} {'sort':>5}  column")
+    print("-" * 60)
+    for uses, table, columns, usage, composite in candidates:
+        label = f"{table.name}({', '.join(columns)})"
+        print(f"{uses:>5} {usage.filters:>6} {usage.sorts:>5}  {label}{'  [composite]' if composite else ''}")
+        for location in usage.locations[:2]:
+            print(f"{'':>20}{location}")
+
+    sql_lines = []
+    sql_lines.append("-- Suggested indexes for unindexed filter / sort columns")
+    sql_lines.append("-- Generated by index-advisor.py from drizzle/schema.ts and server/**/*.ts usage")
+    sql_lines.append("-- Review before applying: ranked by number of uses in server code")
+    sql_lines.append("")
+    by_table = defaultdict(list)
+    tables_by_name = {table.name: table for table in tables}
+    for uses, table, columns, usage, composite in candidates:
+        by_table[table.name].append((uses, columns))
+    for table_name in sorted(by_table, key=lambda name: -max(uses for uses, _ in by_table[name])):
+        sql_lines.append(f"-- {table_name} table indexes")
+        for uses, columns in by_table[table_name]:
+            sql_lines.append(f"{create_index_sql(tables_by_name[table_name], columns, args.snake_case, dialect)}"
+                             f"  -- {uses} uses")
+        sql_lines.append("")
+    with open(args.output, 'w') as f:
+        f.write("\n".join(sql_lines))
+    print()
+    print(f"✓ Generated: {args.output} ({len(candidates)} indexes)")
+
+if __name__ == '__main__':
+    main()
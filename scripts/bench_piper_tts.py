@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmark suite for server/piperTTS.py.
+Runs against scripts/fake_piper.py and a throwaway cache directory, so
+results depend only on piperTTS.py itself and the fake's tuning.
+
+Measures:
+    - cache-miss and cache-hit latency of generate_speech()
+    - throughput at several concurrency levels (cold cache)
+    - hit/miss lookup latency and get_cache_stats() cost as the cache grows
+
+Usage:
+    python scripts/bench_piper_tts.py [--scales 10000 100000 1000000] [--output results.json]
+    python scripts/bench_piper_tts.py --compare baseline.json --output current.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import importlib
+import statistics
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_PIPER = os.path.join(PROJECT_ROOT, 'scripts', 'fake_piper.py')
+LANGUAGE = 'es'
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': round(pick(0.50), 3),
+        'p95_ms': round(pick(0.95), 3),
+        'p99_ms': round(pick(0.99), 3),
+    }
+
+
+def timed(fn, *args) -> float:
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def load_piper_tts(cache_dir: str, voices_dir: str):
+    """Import server/piperTTS.py configured for the fake piper and temp dirs."""
+    os.environ['PIPER_TTS_CACHE_DIR'] = cache_dir
+    os.environ['PIPER_TTS_VOICES_DIR'] = voices_dir
+    os.environ['PIPER_TTS_PIPER_BIN'] = FAKE_PIPER
+    sys.path.insert(0, os.path.join(PROJECT_ROOT, 'server'))
+    module = importlib.import_module('piperTTS')
+
+    # Benchmarks must not pick up a real in-process voice
+    module.PiperVoice = None
+    for voice_model in set(module.VOICE_MODELS.values()):
+        open(os.path.join(voices_dir, f'{voice_model}.onnx'), 'a').close()
+    return module
+
+
+def bench_latency(tts, requests: int) -> Dict:
+    """Cold (miss) then warm (hit) latency for the same texts."""
+    texts = [f'Frase de prueba número {i}.' for i in range(requests)]
+    misses = [timed(tts.generate_speech, text, LANGUAGE) for text in texts]
+    hits = [timed(tts.generate_speech, text, LANGUAGE) for text in texts]
+    return {'miss': percentiles(misses), 'hit': percentiles(hits)}
+
+
+def bench_throughput(tts, concurrency_levels: List[int], requests: int) -> Dict:
+    """Requests/s for cold-cache requests at each concurrency level."""
+    results = {}
+    for concurrency in concurrency_levels:
+        texts = [f'Concurrencia {concurrency}, petición {i}.' for i in range(requests)]
+        latencies = []
+
+        def run(text):
+            latencies.append(timed(tts.generate_speech, text, LANGUAGE))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(run, texts))
+        elapsed = time.perf_counter() - started
+        results[str(concurrency)] = {
+            'requests_per_s': round(requests / elapsed, 2),
+            'latency': percentiles(latencies),
+        }
+    return results
+
+
+def populate_cache(tts, target_entries: int, clip: bytes) -> None:
+    """Grow the cache to target_entries synthetic clips (files + index rows)."""
+    conn = tts.get_cache_index()
+    current = int(tts.get_cache_stats()['file_count'])
+    now = time.time()
+    batch = []
+    for i in range(current, target_entries):
+        key = tts.get_cache_key(f'relleno {i}', LANGUAGE, 1.0)
+        path = tts.get_cache_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(clip)
+        batch.append((key, LANGUAGE, len(clip), now, now))
+        if len(batch) >= 10000:
+            conn.executemany(
+                'INSERT OR IGNORE INTO entries (cache_key, language, size, created_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?)', batch)
+            batch = []
+    if batch:
+        conn.executemany(
+            'INSERT OR IGNORE INTO entries (cache_key, language, size, created_at, last_access) '
+            'VALUES (?, ?, ?, ?, ?)', batch)
+
+
+def bench_scaling(tts, scales: List[int], lookups: int) -> Dict:
+    """Lookup and stats cost at increasing cache sizes."""
+    clip = tts.create_wav_header(b'\0' * 2048) + b'\0' * 2048
+    rng = random.Random(0)  # same lookup keys on every run
+    results = {}
+    for scale in sorted(scales):
+        started = time.perf_counter()
+        populate_cache(tts, scale, clip)
+        populate_s = time.perf_counter() - started
+
+        present = [tts.get_cache_key(f'relleno {rng.randrange(scale)}', LANGUAGE, 1.0) for _ in range(lookups)]
+        absent = [tts.get_cache_key(f'ausente {i}', LANGUAGE, 1.0) for i in range(lookups)]
+        results[str(scale)] = {
+            'populate_s': round(populate_s, 2),
+            'hit_lookup': percentiles([timed(tts.get_cached_audio, key) for key in present]),
+            'miss_lookup': percentiles([timed(tts.get_cached_audio, key) for key in absent]),
+            'stats_call': percentiles([timed(tts.get_cache_stats) for _ in range(20)]),
+        }
+        print(f"  scale {scale}: done", file=sys.stderr)
+    return results
+
+
+def compare(baseline: Dict, current: Dict, path: str = '') -> None:
+    """Print current/baseline ratios for every matching numeric result."""
+    for key, value in current.items():
+        other = baseline.get(key) if isinstance(baseline, dict) else None
+        name = f'{path}.{key}' if path else key
+        if isinstance(value, dict) and isinstance(other, dict):
+            compare(other, value, name)
+        elif isinstance(value, (int, float)) and isinstance(other, (int, float)) and other:
+            print(f"{name:60} {other:>12} -> {value:>12}  ({value / other:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark server/piperTTS.py against a fake piper')
+    parser.add_argument('--requests', type=int, default=50, help='requests per latency/throughput run')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='cache sizes (entries) for the scaling run')
+    parser.add_argument('--lookups', type=int, default=200, help='lookups per scale')
+    parser.add_argument('--output', help='write JSON results here (default: stdout)')
+    parser.add_argument('--compare', help='baseline JSON results to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='piper-bench-') as tmp_dir:
+        voices_dir = os.path.join(tmp_dir, 'voices')
+        os.makedirs(voices_dir)
+        tts = load_piper_tts(os.path.join(tmp_dir, 'cache'), voices_dir)
+
+        print("Benchmarking latency...", file=sys.stderr)
+        latency = bench_latency(tts, args.requests)
+        print("Benchmarking throughput...", file=sys.stderr)
+        throughput = bench_throughput(tts, args.concurrency, args.requests)
+        tts.clear_cache()
+        print("Benchmarking cache scaling...", file=sys.stderr)
+        scaling = bench_scaling(tts, args.scales, args.lookups)
+
+    git_rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+                             capture_output=True, text=True).stdout.strip()
+    results = {
+        'meta': {
+            'timestamp': time.time(),
+            'git_rev': git_rev or None,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'fake_piper': {name: os.environ.get(name) for name in
+                           ('FAKE_PIPER_STARTUP_MS', 'FAKE_PIPER_MS_PER_CHAR', 'FAKE_PIPER_SAMPLE_RATE')},
+            'args': vars(args),
+        },
+        'latency': latency,
+        'throughput': throughput,
+        'scaling': scaling,
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"✓ Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\nComparison (baseline -> current):", file=sys.stderr)
+        compare(baseline, {k: v for k, v in results.items() if k != 'meta'})
+
+
+if __name__ == '__main__':
+    main()
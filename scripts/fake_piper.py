@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Deterministic stand-in for the piper binary, for TTS benchmarks.
+Accepts the piper arguments used by server/piperTTS.py and emits PCM
+derived from the input text after a tunable delay, without loading a model.
+
+Point piperTTS.py at it with PIPER_TTS_PIPER_BIN=scripts/fake_piper.py.
+Tuning (environment):
+    FAKE_PIPER_STARTUP_MS   fixed delay per invocation (model load), default 50
+    FAKE_PIPER_MS_PER_CHAR  synthesis delay per input character, default 1
+    FAKE_PIPER_SAMPLE_RATE  output sample rate, default 22050
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import wave
+import struct
+import hashlib
+import argparse
+
+STARTUP_MS = float(os.environ.get('FAKE_PIPER_STARTUP_MS', '50'))
+MS_PER_CHAR = float(os.environ.get('FAKE_PIPER_MS_PER_CHAR', '1'))
+SAMPLE_RATE = int(os.environ.get('FAKE_PIPER_SAMPLE_RATE', '22050'))
+# Audio length per input character at length_scale 1.0, roughly speech rate
+SECONDS_PER_CHAR = 0.06
+
+
+def synthesize(text: str, length_scale: float) -> bytes:
+    """Deterministic 16-bit PCM: a tone whose pitch depends on the text hash."""
+    time.sleep(MS_PER_CHAR * len(text) / 1000)
+    digest = hashlib.md5(text.encode('utf-8')).digest()
+    frequency = 120 + digest[0] * 2
+    samples = int(len(text) * SECONDS_PER_CHAR * length_scale * SAMPLE_RATE)
+    step = 2 * math.pi * frequency / SAMPLE_RATE
+    return struct.pack(f'<{samples}h', *(int(8000 * math.sin(i * step)) for i in range(samples)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake piper for benchmarks')
+    parser.add_argument('--model', required=True)
+    parser.add_argument('--output_raw', action='store_true')
+    parser.add_argument('--length_scale', type=float, default=1.0)
+    parser.add_argument('--json-input', action='store_true')
+    args = parser.parse_args()
+
+    time.sleep(STARTUP_MS / 1000)
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        if args.json_input:
+            request = json.loads(line)
+            with wave.open(request['output_file'], 'wb') as wav_file:
+                wav_file.setnchannels(1)
+                wav_file.setsampwidth(2)
+                wav_file.setframerate(SAMPLE_RATE)
+                wav_file.writeframes(synthesize(request['text'], args.length_scale))
+        else:
+            sys.stdout.buffer.write(synthesize(line, args.length_scale))
+            sys.stdout.buffer.flush()
+
+
+if __name__ == '__main__':
+    main()
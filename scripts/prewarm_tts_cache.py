@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Pre-warm the Piper TTS cache from vocabulary datasets.
+Renders every word and example sentence into the TTS cache in parallel so
+new lesson releases don't hit cold cache misses in production.
+
+Usage:
+    python scripts/prewarm_tts_cache.py [files...] [--speeds 1.0 0.85] [--workers N]
+
+Defaults to scripts/vocabulary-data-spanish.json and the vocabulary-*.json
+files in the project root (as written by generate_vocabulary.py).
+Progress is recorded in a state file, so an interrupted run resumes where
+it stopped.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Tuple
+
+# Add server directory to path to import piperTTS
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'server'))
+
+import piperTTS  # noqa: E402
+
+TEXT_FIELDS = ('word', 'exampleSentence')
+# Items per worker task; each task is a single voice so it loads one model
+CHUNK_SIZE = 25
+
+
+def default_input_files() -> List[str]:
+    """Spanish dataset plus per-language vocabulary files in the project root."""
+    files = [os.path.join(PROJECT_ROOT, 'scripts', 'vocabulary-data-spanish.json')]
+    files += sorted(glob.glob(os.path.join(PROJECT_ROOT, 'vocabulary-*.json')))
+    return [f for f in files if os.path.exists(f)]
+
+
+def is_placeholder(text: str) -> bool:
+    """Template entries from generate_vocabulary.py look like '[...]'."""
+    return text.startswith('[') and text.endswith(']')
+
+
+def collect_items(files: List[str], speeds: List[float]) -> List[Dict]:
+    """Extract unique, supported {text, language, speed} items with cache keys."""
+    items = {}
+    for path in files:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        for entry in entries:
+            language = entry.get('language')
+            if language not in piperTTS.VOICE_MODELS:
+                continue
+            for field in TEXT_FIELDS:
+                text = (entry.get(field) or '').strip()
+                if not text or is_placeholder(text):
+                    continue
+                for speed in speeds:
+                    key = piperTTS.get_cache_key(text, language, speed)
+                    items.setdefault(key, {'key': key, 'text': text, 'language': language, 'speed': speed})
+    return list(items.values())
+
+
+def make_chunks(items: List[Dict]) -> List[List[Dict]]:
+    """Group items by voice model and speed, then split into CHUNK_SIZE tasks."""
+    groups: Dict[Tuple[str, float], List[Dict]] = {}
+    for item in items:
+        voice_model = piperTTS.VOICE_MODELS[item['language']]
+        groups.setdefault((voice_model, item['speed']), []).append(item)
+
+    chunks = []
+    for group in groups.values():
+        for i in range(0, len(group), CHUNK_SIZE):
+            chunks.append(group[i:i + CHUNK_SIZE])
+    return chunks
+
+
+def render_chunk(chunk: List[Dict]) -> List[Tuple[str, bool]]:
+    """Worker: synthesize one chunk into the cache, returning (key, ok) pairs."""
+    results = piperTTS.generate_speech_batch(chunk)
+    return [(item['key'], audio is not None) for item, audio in zip(chunk, results)]
+
+
+def load_state(state_path: str) -> set:
+    """Cache keys completed by previous runs."""
+    if not os.path.exists(state_path):
+        return set()
+    with open(state_path, 'r') as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-warm the Piper TTS cache from vocabulary datasets')
+    parser.add_argument('files', nargs='*', help='vocabulary JSON files (default: bundled datasets)')
+    parser.add_argument('--speeds', type=float, nargs='+', default=[1.0],
+                        help='playback speeds to render (default: 1.0)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='parallel worker processes (default: CPU count)')
+    parser.add_argument('--state', default=os.path.join(piperTTS.CACHE_DIR, 'prewarm-state.txt'),
+                        help='resume state file of completed cache keys')
+    parser.add_argument('--restart', action='store_true', help='ignore the resume state file')
+    args = parser.parse_args()
+
+    files = args.files or default_input_files()
+    print(f"Collecting items from {len(files)} file(s)...")
+    items = collect_items(files, args.speeds)
+
+    done = set() if args.restart else load_state(args.state)
+    pending = [item for item in items if item['key'] not in done and not piperTTS.is_cached(item['key'])]
+    print(f"Items: {len(items)} total, {len(items) - len(pending)} already cached, {len(pending)} to render")
+    if not pending:
+        print("✓ Cache is already warm")
+        return
+
+    chunks = make_chunks(pending)
+    completed = failed = 0
+    started = time.time()
+
+    with open(args.state, 'a') as state, ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(render_chunk, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            for key, ok in future.result():
+                if ok:
+                    completed += 1
+                    state.write(key + '\n')
+                else:
+                    failed += 1
+            state.flush()
+
+            processed = completed + failed
+            rate = processed / max(time.time() - started, 1e-6)
+            eta = (len(pending) - processed) / rate if rate else 0
+            print(f"  {processed}/{len(pending)} rendered ({failed} failed), "
+                  f"{rate:.1f} items/s, ETA {eta:.0f}s", flush=True)
+
+    print(f"\n✅ Rendered {completed} items in {time.time() - started:.1f}s ({failed} failed)")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
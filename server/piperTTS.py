@@ -6,16 +6,119 @@ Provides high-quality text-to-speech synthesis with caching
 
 import os
 import sys
+import re
 import json
+import mmap
+import errno
+import array
+import fcntl
+import wave
+import tempfile
+import math
+import time
+import sqlite3
+import argparse
+import signal
+import socket
+import asyncio
+import itertools
+import contextvars
+import struct
 import hashlib
+import unicodedata
+import threading
 import subprocess
+import contextlib
+import socketserver
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple, List, Iterable, Iterator, Callable, Union, BinaryIO
 
-# Configuration
-VOICES_DIR = Path("/home/ubuntu/piper-voices")
-CACHE_DIR = Path("/home/ubuntu/sarcastic-ai-assistant/server/tts-cache")
-CACHE_DIR.mkdir(exist_ok=True)
+try:
+    # In-process synthesis (piper-tts package); falls back to the piper CLI
+    from piper.voice import PiperVoice
+except ImportError:
+    PiperVoice = None
+
+try:
+    # Audio processing (time-stretching); features degrade gracefully without it
+    import numpy as np
+except ImportError:
+    np = None
+
+# Configuration (overridable for benchmarks and local development)
+VOICES_DIR = Path(os.environ.get("PIPER_TTS_VOICES_DIR", "/home/ubuntu/piper-voices"))
+CACHE_DIR = Path(os.environ.get("PIPER_TTS_CACHE_DIR", "/home/ubuntu/sarcastic-ai-assistant/server/tts-cache"))
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+PIPER_BIN = os.environ.get("PIPER_TTS_PIPER_BIN", "/home/ubuntu/piper-venv/bin/piper")
+DEFAULT_SOCKET_PATH = os.environ.get("PIPER_TTS_SOCKET", "/tmp/piper-tts.sock")
+
+# Cache budget (0 = unlimited). When exceeded, least recently used clips are
+# evicted until the cache is back under CACHE_LOW_WATER of the budget.
+CACHE_MAX_MB = float(os.environ.get("PIPER_TTS_CACHE_MAX_MB", "0"))
+CACHE_MAX_FILES = int(os.environ.get("PIPER_TTS_CACHE_MAX_FILES", "0"))
+CACHE_LOW_WATER = 0.9
+# In-memory LRU of hot clips in front of the disk cache, used by the server
+# modes (per process). Hits on it reach the index in batches every
+# HOT_CACHE_FLUSH_SECONDS, when the tier is also dropped if clips were
+# invalidated by another process in the meantime.
+HOT_CACHE_MB = float(os.environ.get("PIPER_TTS_HOT_CACHE_MB", "64"))
+HOT_CACHE_FLUSH_SECONDS = 5.0
+# Larger clips stay on disk and are served from the file (see send_audio)
+HOT_CACHE_MAX_CLIP_BYTES = 1024 * 1024
+# SQLite manifest of cached clips; totals are maintained by triggers so
+# stats and budget checks never have to walk CACHE_DIR
+CACHE_INDEX_PATH = CACHE_DIR / "index.sqlite3"
+
+WAV_HEADER_SIZE = 44
+# Used when a voice's .onnx.json config is missing or has no sample rate
+DEFAULT_SAMPLE_RATE = 22050
+# Output rates clients may request; clips are resampled from the voice's rate
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 48000
+# Output encodings: 16-bit PCM, 8-bit G.711 µ-law (2x smaller) and 4-bit
+# IMA-ADPCM (~4x smaller), all in WAV containers
+AUDIO_FORMATS = ("pcm16", "ulaw", "adpcm")
+ADPCM_BLOCK_ALIGN = 512
+# IMA-ADPCM encoding is a pure-Python loop (~0.8 s per 30 s of audio) that
+# holds the GIL. The threaded servers (--daemon, --async) encode PCM longer
+# than this in ADPCM_OFFLOAD_WORKERS helper processes so their other
+# threads keep running (0 = always encode in the calling thread); one-shot
+# CLI runs and single-threaded pool workers always encode inline.
+ADPCM_OFFLOAD_BYTES = int(os.environ.get("PIPER_TTS_ADPCM_OFFLOAD_BYTES", str(2 * DEFAULT_SAMPLE_RATE)))
+ADPCM_OFFLOAD_WORKERS = 2
+# RIFF/data size used while the final length is unknown (streaming)
+WAV_STREAMING_SIZE = 0xFFFFFFFF
+STREAM_CHUNK_SIZE = 8192
+
+# Derive non-1.0x speeds from the cached 1.0x clip by time-stretching
+# instead of re-synthesizing (requires numpy). Derived clips are not cached.
+DERIVE_SPEEDS = os.environ.get("PIPER_TTS_DERIVE_SPEEDS", "") == "1" and np is not None
+
+# Seconds one piper invocation may take, unless the request carries its own
+# deadline (see request_deadline)
+SYNTHESIS_TIMEOUT = 10.0
+
+# Multi-sentence texts are assembled from individually cached sentences, so
+# texts sharing sentences reuse their audio; set PIPER_TTS_SEGMENT_CACHE=0
+# to synthesize every text in one piece. Segments overlap by a short
+# crossfade (requires numpy; plain concatenation without it).
+SEGMENT_CACHE = os.environ.get("PIPER_TTS_SEGMENT_CACHE", "1") != "0"
+SEGMENT_CROSSFADE_MS = 10
+# Sentences of one text missing from the cache are synthesized together:
+# in one piper process with the CLI, or concurrently on this many threads
+# with in-process voices (0 or 1 = one after another)
+SEGMENT_WORKERS = int(os.environ.get("PIPER_TTS_SEGMENT_WORKERS", str(os.cpu_count() or 1)))
+
+# Opt-in per-request timing: PIPER_TTS_METRICS=1 aggregates histograms
+# (see export_prometheus); PIPER_TTS_METRICS_LOG=<path> or "-" (stderr)
+# additionally writes one JSON line per request
+METRICS_LOG = os.environ.get("PIPER_TTS_METRICS_LOG", "")
+METRICS_ENABLED = bool(METRICS_LOG) or os.environ.get("PIPER_TTS_METRICS", "") == "1"
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
 
 # Language to voice model mapping
 VOICE_MODELS: Dict[str, str] = {
@@ -30,27 +133,1091 @@ VOICE_MODELS: Dict[str, str] = {
 }
 
 
-def get_cache_key(text: str, language: str, speed: float) -> str:
-    """Generate cache key for audio file"""
-    content = f"{text}|{language}|{speed}"
+# Speeds are rounded to this step so near-identical requests share a clip
+SPEED_STEP = 0.05
+# Supported speed range (after rounding), as accepted by the tRPC router
+MIN_SPEED = 0.5
+MAX_SPEED = 2.0
+
+
+def normalize_text(text: str) -> str:
+    """NFC-normalize text and collapse runs of whitespace"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def quantize_speed(speed: float) -> float:
+    """Round speed to the nearest SPEED_STEP"""
+    return round(round(float(speed) / SPEED_STEP) * SPEED_STEP, 2)
+
+
+def is_supported_speed(speed: float) -> bool:
+    """Whether a quantized speed lies in MIN_SPEED..MAX_SPEED"""
+    return MIN_SPEED <= speed <= MAX_SPEED
+
+
+def get_cache_key(text: str, language: str, speed: float, audio_format: str = "pcm16",
+                  sample_rate: Optional[int] = None) -> str:
+    """
+    Generate cache key for audio file.
+    Keyed on the resolved voice model rather than the language code (so
+    'es' and 'es-ES' share entries), normalized text, quantized speed,
+    the output encoding and the output sample rate (None = the voice's own).
+    """
+    voice = VOICE_MODELS.get(language, language)
+    content = f"{voice}|{normalize_text(text)}|{quantize_speed(speed):.2f}"
+    if audio_format != "pcm16":
+        content += f"|{audio_format}"
+    if sample_rate:
+        content += f"|{sample_rate}Hz"
     return hashlib.md5(content.encode()).hexdigest()
 
 
-def get_cached_audio(cache_key: str) -> Optional[bytes]:
-    """Retrieve cached audio if available"""
-    cache_file = CACHE_DIR / f"{cache_key}.wav"
-    if cache_file.exists():
+def get_cache_path(cache_key: str) -> Path:
+    """Sharded cache location: <CACHE_DIR>/ab/cd/abcd....wav"""
+    return CACHE_DIR / cache_key[:2] / cache_key[2:4] / f"{cache_key}.wav"
+
+
+_CACHE_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    cache_key TEXT PRIMARY KEY,
+    language TEXT NOT NULL DEFAULT '',
+    voice_model TEXT NOT NULL DEFAULT '',
+    text TEXT,
+    speed REAL,
+    audio_format TEXT NOT NULL DEFAULT 'pcm16',
+    sample_rate INTEGER,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+
+CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value REAL NOT NULL);
+INSERT OR IGNORE INTO totals (name, value) VALUES
+    ('entries', 0), ('bytes', 0), ('hits', 0), ('misses', 0), ('last_access', 0),
+    ('invalidations', 0);
+
+CREATE TABLE IF NOT EXISTS language_totals (
+    language TEXT PRIMARY KEY,
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    UPDATE totals SET value = value + 1 WHERE name = 'entries';
+    UPDATE totals SET value = value + NEW.size WHERE name = 'bytes';
+    INSERT INTO language_totals (language, entries, bytes) VALUES (NEW.language, 1, NEW.size)
+        ON CONFLICT (language) DO UPDATE SET entries = entries + 1, bytes = bytes + NEW.size;
+END;
+
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    UPDATE totals SET value = value - 1 WHERE name = 'entries';
+    UPDATE totals SET value = value - OLD.size WHERE name = 'bytes';
+    UPDATE language_totals SET entries = entries - 1, bytes = bytes - OLD.size
+        WHERE language = OLD.language;
+END;
+
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size, language ON entries BEGIN
+    UPDATE totals SET value = value - OLD.size + NEW.size WHERE name = 'bytes';
+    UPDATE language_totals SET entries = entries - 1, bytes = bytes - OLD.size
+        WHERE language = OLD.language;
+    INSERT INTO language_totals (language, entries, bytes) VALUES (NEW.language, 1, NEW.size)
+        ON CONFLICT (language) DO UPDATE SET entries = entries + 1, bytes = bytes + NEW.size;
+END;
+"""
+
+# Columns added after the index was introduced: {column: definition}
+_CACHE_INDEX_ADDED_COLUMNS = {
+    "audio_format": "TEXT NOT NULL DEFAULT 'pcm16'",
+    "sample_rate": "INTEGER",  # resampled output rate, NULL for the voice's own
+}
+
+# One connection per thread and process (connections must not cross a fork)
+_index_local = threading.local()
+
+
+def get_cache_index() -> sqlite3.Connection:
+    """Open (and create if needed) the cache index for this thread"""
+    conn = getattr(_index_local, "conn", None)
+    if conn is not None and _index_local.pid == os.getpid():
+        return conn
+
+    conn = sqlite3.connect(str(CACHE_INDEX_PATH), timeout=5.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_CACHE_INDEX_SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+    for column, definition in _CACHE_INDEX_ADDED_COLUMNS.items():
+        if column not in columns:
+            try:
+                conn.execute(f"ALTER TABLE entries ADD COLUMN {column} {definition}")
+            except sqlite3.OperationalError:
+                pass  # added concurrently by another process
+    _index_local.conn = conn
+    _index_local.pid = os.getpid()
+    return conn
+
+
+def _index_totals(conn: sqlite3.Connection) -> Dict[str, float]:
+    return dict(conn.execute("SELECT name, value FROM totals"))
+
+
+def _index_record_entry(cache_key: str, size: int, language: str = "", voice_model: str = "",
+                        text: Optional[str] = None, speed: Optional[float] = None,
+                        audio_format: str = "pcm16", sample_rate: Optional[int] = None) -> None:
+    now = time.time()
+    get_cache_index().execute(
+        """
+        INSERT INTO entries (cache_key, language, voice_model, text, speed, audio_format,
+                             sample_rate, size, created_at, last_access)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (cache_key) DO UPDATE SET
+            language = excluded.language, voice_model = excluded.voice_model,
+            text = excluded.text, speed = excluded.speed, audio_format = excluded.audio_format,
+            sample_rate = excluded.sample_rate, size = excluded.size,
+            last_access = excluded.last_access
+        """,
+        (cache_key, language, voice_model, text, speed, audio_format, sample_rate, size, now, now),
+    )
+
+
+def _index_record_hit(cache_key: str, size: int, after_miss: bool = False) -> None:
+    """Count a hit; after_miss turns the miss already counted for this lookup into the hit"""
+    conn = get_cache_index()
+    now = time.time()
+    with conn:
+        conn.execute("BEGIN")
+        updated = conn.execute(
+            "UPDATE entries SET hits = hits + 1, last_access = ? WHERE cache_key = ?",
+            (now, cache_key),
+        ).rowcount
+        if not updated:
+            # Clip predates the index (or the index was rebuilt): adopt it
+            conn.execute(
+                "INSERT INTO entries (cache_key, size, created_at, last_access, hits) VALUES (?, ?, ?, ?, 1)",
+                (cache_key, size, now, now),
+            )
+        conn.execute("UPDATE totals SET value = value + 1 WHERE name = 'hits'")
+        if after_miss:
+            conn.execute("UPDATE totals SET value = value - 1 WHERE name = 'misses'")
+        conn.execute("UPDATE totals SET value = ? WHERE name = 'last_access'", (now,))
+
+
+def _index_record_miss() -> None:
+    get_cache_index().execute("UPDATE totals SET value = value + 1 WHERE name = 'misses'")
+
+
+def _index_record_hits(counts: Dict[str, int]) -> None:
+    """Record hits served by the hot tier: {cache_key: hit count}"""
+    if not counts:
+        return
+    conn = get_cache_index()
+    now = time.time()
+    with conn:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "UPDATE entries SET hits = hits + ?, last_access = ? WHERE cache_key = ?",
+            [(count, now, key) for key, count in counts.items()],
+        )
+        conn.execute("UPDATE totals SET value = value + ? WHERE name = 'hits'", (sum(counts.values()),))
+        conn.execute("UPDATE totals SET value = ? WHERE name = 'last_access'", (now,))
+
+
+def _index_remove(cache_keys) -> None:
+    cache_keys = list(cache_keys)
+    if _hot_cache is not None:
+        _hot_cache.discard(cache_keys)
+    conn = get_cache_index()
+    with conn:
+        conn.execute("BEGIN")
+        conn.executemany("DELETE FROM entries WHERE cache_key = ?", [(k,) for k in cache_keys])
+
+
+class HotCache:
+    """Byte-bounded in-memory LRU of cached clips, with hit/miss counters"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.flushed_at = time.monotonic()
+        self.invalidations = None  # index invalidation count the tier is consistent with
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._pending_hits: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, cache_key: str) -> Optional[bytes]:
+        with self._lock:
+            audio_data = self._entries.get(cache_key)
+            if audio_data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            self._pending_hits[cache_key] = self._pending_hits.get(cache_key, 0) + 1
+            return audio_data
+
+    def put(self, cache_key: str, audio_data: bytes) -> None:
+        if len(audio_data) > min(self.max_bytes, HOT_CACHE_MAX_CLIP_BYTES):
+            return
+        with self._lock:
+            previous = self._entries.pop(cache_key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[cache_key] = audio_data
+            self.size += len(audio_data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, cache_keys) -> None:
+        with self._lock:
+            for cache_key in cache_keys:
+                audio_data = self._entries.pop(cache_key, None)
+                if audio_data is not None:
+                    self.size -= len(audio_data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def take_pending_hits(self) -> Dict[str, int]:
+        """Hits not yet recorded in the index, resetting them"""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+            self.flushed_at = time.monotonic()
+            return pending
+
+    def stats(self) -> Dict[str, any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "file_count": len(self._entries),
+                "total_size_mb": round(self.size / (1024 * 1024), 2),
+                "max_size_mb": round(self.max_bytes / (1024 * 1024), 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+_hot_cache: Optional[HotCache] = None
+
+
+def enable_hot_cache(max_mb: float = HOT_CACHE_MB) -> None:
+    """Serve hits from memory in this process (server modes); 0 disables it"""
+    global _hot_cache
+    _hot_cache = HotCache(int(max_mb * 1024 * 1024)) if max_mb > 0 else None
+    if _hot_cache is not None:
+        _hot_cache.invalidations = _index_totals(get_cache_index())["invalidations"]
+
+
+def flush_hot_cache_hits() -> None:
+    """
+    Record hot-tier hits in the cache index (totals and LRU order), and
+    drop the tier if clips were invalidated since the last flush
+    """
+    if _hot_cache is None:
+        return
+    _index_record_hits(_hot_cache.take_pending_hits())
+    invalidations = _index_totals(get_cache_index())["invalidations"]
+    if _hot_cache.invalidations is not None and invalidations != _hot_cache.invalidations:
+        _hot_cache.clear()
+    _hot_cache.invalidations = invalidations
+
+
+def is_cached(cache_key: str) -> bool:
+    """Whether a clip is cached, without reading it or counting a hit"""
+    return get_cache_path(cache_key).exists() or (CACHE_DIR / f"{cache_key}.wav").exists()
+
+
+def _read_cache_file(cache_key: str) -> Optional[bytes]:
+    """Read a cached clip without hit/miss accounting"""
+    cache_file = get_cache_path(cache_key)
+    try:
         return cache_file.read_bytes()
-    return None
+    except FileNotFoundError:
+        pass
+
+    # Entries written before sharding live flat in CACHE_DIR; move on access
+    legacy_file = CACHE_DIR / f"{cache_key}.wav"
+    if not legacy_file.exists():
+        return None
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(legacy_file, cache_file)
+    except FileNotFoundError:
+        pass  # moved concurrently by another reader
+    try:
+        return cache_file.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def _open_cache_file(cache_key: str) -> Optional[BinaryIO]:
+    """Open a cached clip for reading without hit/miss accounting"""
+    try:
+        return open(get_cache_path(cache_key), "rb")
+    except FileNotFoundError:
+        pass
+    # Shard a legacy flat entry first
+    if _read_cache_file(cache_key) is None:
+        return None
+    try:
+        return open(get_cache_path(cache_key), "rb")
+    except FileNotFoundError:
+        return None
 
 
-def save_to_cache(cache_key: str, audio_data: bytes) -> None:
-    """Save audio to cache"""
-    cache_file = CACHE_DIR / f"{cache_key}.wav"
-    cache_file.write_bytes(audio_data)
+def get_cached_audio(cache_key: str, open_file: bool = False) -> Union[bytes, BinaryIO, None]:
+    """
+    Retrieve cached audio if available, from the hot tier when enabled.
+    With open_file, a clip that would be read from disk (and is too large
+    for the hot tier) is returned as an open file instead, for send_audio().
+    """
+    if _hot_cache is not None:
+        if time.monotonic() - _hot_cache.flushed_at > HOT_CACHE_FLUSH_SECONDS:
+            flush_hot_cache_hits()
+        audio_data = _hot_cache.get(cache_key)
+        if audio_data is not None:
+            return audio_data
 
+    if open_file:
+        cache_file = _open_cache_file(cache_key)
+        if cache_file is None:
+            _index_record_miss()
+            return None
+        size = os.fstat(cache_file.fileno()).st_size
+        _index_record_hit(cache_key, size)
+        if _hot_cache is None or size > HOT_CACHE_MAX_CLIP_BYTES:
+            return cache_file
+        with cache_file:
+            audio_data = cache_file.read()
+        _hot_cache.put(cache_key, audio_data)
+        return audio_data
+
+    audio_data = _read_cache_file(cache_key)
+    if audio_data is None:
+        _index_record_miss()
+        return None
 
-def generate_speech(text: str, language: str, speed: float = 1.0) -> Optional[bytes]:
+    _index_record_hit(cache_key, len(audio_data))
+    if _hot_cache is not None:
+        _hot_cache.put(cache_key, audio_data)
+    return audio_data
+
+
+def save_to_cache(cache_key: str, audio_data: Union[bytes, List[bytes]], language: str = "",
+                  voice_model: str = "", text: Optional[str] = None, speed: Optional[float] = None,
+                  audio_format: str = "pcm16", sample_rate: Optional[int] = None) -> None:
+    """
+    Save audio to cache and record it in the cache index.
+    audio_data may be a list of parts (e.g. from encode_wav_parts), written
+    in order without joining them first. Written to a temp file and
+    renamed, so readers never see a partial clip.
+    """
+    parts = [audio_data] if isinstance(audio_data, (bytes, bytearray, memoryview)) else audio_data
+    size = sum(len(part) for part in parts)
+    cache_file = get_cache_path(cache_key)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_file.parent, prefix=f".{cache_key}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.writelines(parts)
+        os.replace(tmp_path, cache_file)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+    _index_record_entry(cache_key, size, language, voice_model, text, speed,
+                        audio_format, sample_rate)
+    if _hot_cache is not None and size <= HOT_CACHE_MAX_CLIP_BYTES:
+        _hot_cache.put(cache_key, b"".join(parts))
+
+    if CACHE_MAX_MB or CACHE_MAX_FILES:
+        evict_cache()
+
+
+# Per-key locks for in-process single-flight: {cache_key: [lock, waiters]}
+_fill_locks: Dict[str, list] = {}
+_fill_locks_guard = threading.Lock()
+
+
+@contextlib.contextmanager
+def cache_fill_lock(cache_key: str):
+    """
+    Hold the right to synthesize cache_key, across threads and processes.
+    
+    Threads share a per-key lock; processes additionally take an exclusive
+    flock on CACHE_DIR/.locks/<key>.lock. Callers must re-check the cache
+    once the lock is held, since the previous holder has usually filled it.
+    """
+    with _fill_locks_guard:
+        entry = _fill_locks.setdefault(cache_key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            lock_dir = CACHE_DIR / ".locks"
+            lock_dir.mkdir(exist_ok=True)
+            lock_path = lock_dir / f"{cache_key}.lock"
+            while True:
+                fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # The previous holder unlinks the file on release; if it did
+                # so while we waited, our lock is on a stale inode
+                try:
+                    if os.fstat(fd).st_ino == os.stat(lock_path).st_ino:
+                        break
+                except FileNotFoundError:
+                    pass
+                os.close(fd)
+            try:
+                yield
+            finally:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(lock_path)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+    finally:
+        with _fill_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _fill_locks[cache_key]
+
+
+def _fill_cache(cache_key: str, wav_data: bytes, language: str, voice_model: str, text: str,
+                speed: float, audio_format: str = "pcm16", sample_rate: Optional[int] = None) -> bytes:
+    """
+    Cache a clip synthesized outside the fill lock, unless a concurrent
+    request cached cache_key first. Returns the clip now in the cache.
+    """
+    with cache_fill_lock(cache_key):
+        cached = _read_cache_file(cache_key)
+        if cached:
+            _index_record_hit(cache_key, len(cached), after_miss=True)
+            return cached
+        save_to_cache(cache_key, wav_data, language, voice_model, text, speed, audio_format, sample_rate)
+    return wav_data
+
+
+def iter_cache_files():
+    """Yield os.DirEntry for every cached clip, sharded and legacy flat"""
+    stack = [str(CACHE_DIR)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".wav"):
+                    yield entry
+
+
+def rebuild_cache_index() -> int:
+    """
+    Rebuild the cache index from the files on disk, keeping metadata of
+    entries that are still present. Needed once for caches created before
+    the index existed. Returns number of indexed entries.
+    """
+    conn = get_cache_index()
+    on_disk = {}
+    for entry in iter_cache_files():
+        try:
+            on_disk[entry.name[:-len(".wav")]] = entry.stat()
+        except FileNotFoundError:
+            continue
+
+    indexed = {row[0] for row in conn.execute("SELECT cache_key FROM entries")}
+    _index_remove(indexed - on_disk.keys())
+    with conn:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO entries (cache_key, size, created_at, last_access) VALUES (?, ?, ?, ?)",
+            [(key, st.st_size, st.st_mtime, st.st_mtime)
+             for key, st in on_disk.items() if key not in indexed],
+        )
+    return len(on_disk)
+
+
+def migrate_cache_keys(drop_unknown: bool = False) -> Dict[str, int]:
+    """
+    Re-key indexed clips to the current get_cache_key() scheme, deleting
+    clips whose canonical key is already cached (duplicates such as 'es'
+    vs 'es-ES'). Clips without recorded text/language (adopted from disk)
+    cannot be re-keyed; they are kept to age out, or deleted with
+    drop_unknown. Returns counts of rekeyed/deduplicated/unknown clips.
+    """
+    conn = get_cache_index()
+    counts = {"rekeyed": 0, "deduplicated": 0, "unknown": 0}
+    rows = conn.execute(
+        "SELECT cache_key, language, text, speed, audio_format, sample_rate FROM entries"
+    ).fetchall()
+
+    for old_key, language, text, speed, audio_format, sample_rate in rows:
+        if not text or not language:
+            counts["unknown"] += 1
+            if drop_unknown:
+                _delete_cached(old_key)
+            continue
+
+        new_key = get_cache_key(text, language, speed if speed is not None else 1.0,
+                                audio_format, sample_rate)
+        if new_key == old_key:
+            continue
+
+        old_file = get_cache_path(old_key)
+        if is_cached(new_key) or not old_file.exists():
+            _delete_cached(old_key)
+            counts["deduplicated"] += 1
+            continue
+
+        new_file = get_cache_path(new_key)
+        new_file.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(old_file, new_file)
+        with conn:
+            conn.execute("BEGIN")
+            # Replace a stale row left for new_key by a clip that is gone
+            # from disk (deleted explicitly so the totals triggers run)
+            conn.execute("DELETE FROM entries WHERE cache_key = ?", (new_key,))
+            conn.execute(
+                "UPDATE entries SET cache_key = ?, voice_model = ?, text = ?, speed = ? WHERE cache_key = ?",
+                (new_key, VOICE_MODELS.get(language, ""), normalize_text(text),
+                 quantize_speed(speed if speed is not None else 1.0), old_key),
+            )
+        if _hot_cache is not None:
+            _hot_cache.discard([old_key, new_key])
+        counts["rekeyed"] += 1
+
+    return counts
+
+
+def _unlink_cached(cache_key: str) -> None:
+    """Remove a clip's file, sharded or from the old flat layout adopted by --reindex"""
+    for path in (get_cache_path(cache_key), CACHE_DIR / f"{cache_key}.wav"):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _delete_cached(cache_key: str) -> None:
+    """Remove one clip from disk and from the index"""
+    _unlink_cached(cache_key)
+    _index_remove([cache_key])
+
+
+def repair_sample_rates() -> int:
+    """
+    Rewrite the sample rate in the headers of cached clips that were written
+    with DEFAULT_SAMPLE_RATE by voices that run at another rate (such clips
+    play at the wrong speed and pitch). Only clips whose voice is recorded
+    in the index can be checked. Returns number of clips repaired.
+    """
+    repaired = 0
+    rows = get_cache_index().execute(
+        "SELECT cache_key, voice_model FROM entries WHERE voice_model != '' AND sample_rate IS NULL"
+    ).fetchall()
+    for cache_key, voice_model in rows:
+        sample_rate = get_voice_sample_rate(voice_model)
+        try:
+            with open(get_cache_path(cache_key), "r+b") as cache_file:
+                header = cache_file.read(WAV_HEADER_SIZE)
+                if len(header) < WAV_HEADER_SIZE or header[:4] != b"RIFF":
+                    continue
+                format_tag, _, current_rate, _, block_align = struct.unpack_from("<HHIIH", header, 20)
+                if current_rate == sample_rate:
+                    continue
+                if format_tag == 0x11:
+                    # IMA-ADPCM: bytes per second follow from samples per block
+                    (samples_per_block,) = struct.unpack_from("<H", header, 38)
+                    byte_rate = sample_rate * block_align // samples_per_block
+                else:
+                    byte_rate = sample_rate * block_align
+                cache_file.seek(24)
+                cache_file.write(struct.pack("<II", sample_rate, byte_rate))
+                repaired += 1
+            if _hot_cache is not None:
+                _hot_cache.discard([cache_key])
+        except FileNotFoundError:
+            continue
+    return repaired
+
+
+def evict_cache(max_mb: Optional[float] = None, max_files: Optional[int] = None) -> int:
+    """
+    Evict least recently used clips while the cache exceeds its budget.
+    Defaults to CACHE_MAX_MB / CACHE_MAX_FILES. Returns number of files evicted.
+    """
+    max_bytes = int((CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024)
+    max_files = CACHE_MAX_FILES if max_files is None else max_files
+    if not max_bytes and not max_files:
+        return 0
+
+    conn = get_cache_index()
+    totals = _index_totals(conn)
+    total_size = totals["bytes"]
+    remaining = totals["entries"]
+    over_bytes = max_bytes and total_size > max_bytes
+    over_files = max_files and remaining > max_files
+    if not over_bytes and not over_files:
+        return 0
+
+    target_bytes = max_bytes * CACHE_LOW_WATER if max_bytes else float("inf")
+    target_files = max_files * CACHE_LOW_WATER if max_files else float("inf")
+    evicted = 0
+
+    while total_size > target_bytes or remaining > target_files:
+        batch = conn.execute(
+            "SELECT cache_key, size FROM entries ORDER BY last_access LIMIT 256"
+        ).fetchall()
+        if not batch:
+            break
+        victims = []
+        for cache_key, size in batch:
+            if total_size <= target_bytes and remaining <= target_files:
+                break
+            _unlink_cached(cache_key)
+            victims.append(cache_key)
+            total_size -= size
+            remaining -= 1
+        _index_remove(victims)
+        evicted += len(victims)
+
+    print(f"[Piper TTS] Evicted {evicted} cached clips", file=sys.stderr)
+    return evicted
+
+
+# Voices loaded in-process by load_voices(), keyed by voice model name
+_loaded_voices: Dict[str, "PiperVoice"] = {}
+_voices_lock = threading.Lock()
+# Parsed <voice>.onnx.json files, keyed by voice model name
+_voice_configs: Dict[str, dict] = {}
+
+
+def get_voice_config(voice_model: str) -> dict:
+    """The voice's .onnx.json config (read once per process), {} if unreadable"""
+    config = _voice_configs.get(voice_model)
+    if config is None:
+        config_file = VOICES_DIR / f"{voice_model}.onnx.json"
+        try:
+            config = json.loads(config_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"[Piper TTS] Cannot read voice config {config_file}: {e}", file=sys.stderr)
+            config = {}
+        _voice_configs[voice_model] = config
+    return config
+
+
+def get_voice_sample_rate(voice_model: str) -> int:
+    """Rate the voice synthesizes at, from its config (DEFAULT_SAMPLE_RATE if unknown)"""
+    audio = get_voice_config(voice_model).get("audio") or {}
+    return int(audio.get("sample_rate") or DEFAULT_SAMPLE_RATE)
+
+
+def load_voice(voice_model: str) -> bool:
+    """
+    Load one voice into memory (no-op if already loaded).
+    Only possible when the piper-tts package is importable; otherwise
+    synthesis keeps using the piper CLI. Returns True if the voice is loaded.
+    """
+    if PiperVoice is None:
+        return False
+
+    with _voices_lock:
+        if voice_model in _loaded_voices:
+            return True
+        model_file = VOICES_DIR / f"{voice_model}.onnx"
+        if not model_file.exists():
+            print(f"[Piper TTS] Model not found: {model_file}", file=sys.stderr)
+            return False
+        _loaded_voices[voice_model] = PiperVoice.load(str(model_file))
+        get_voice_config(voice_model)
+        return True
+
+
+def load_voices() -> int:
+    """Load every voice in VOICE_MODELS into memory once. Returns number of voices loaded."""
+    if PiperVoice is None:
+        print("[Piper TTS] piper-tts not importable, using piper CLI", file=sys.stderr)
+        return 0
+
+    for voice_model in sorted(set(VOICE_MODELS.values())):
+        load_voice(voice_model)
+    return len(_loaded_voices)
+
+
+def _piper_command(voice_model: str, speed: float) -> List[str]:
+    """piper CLI invocation writing raw PCM to stdout"""
+    model_file = VOICES_DIR / f"{voice_model}.onnx"
+    cmd = [
+        PIPER_BIN,
+        "--model", str(model_file),
+        "--output_raw",
+    ]
+    # Add length scale for speed control (inverse of speed)
+    # Lower length_scale = faster speech
+    if speed != 1.0:
+        cmd.extend(["--length_scale", str(1.0 / speed)])
+    return cmd
+
+
+# Absolute time.monotonic() deadline of the request being served, if any
+_request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "piper_tts_request_deadline", default=None)
+
+
+@contextlib.contextmanager
+def request_deadline(deadline: Optional[float]):
+    """
+    Bound all synthesis in this context by deadline (time.monotonic()
+    seconds): piper calls get the remaining time as their timeout instead
+    of SYNTHESIS_TIMEOUT. None keeps the fixed per-call timeout.
+    """
+    token = _request_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+
+def synthesis_timeout() -> float:
+    """
+    Timeout for the next piper call: the time left until the request
+    deadline, else SYNTHESIS_TIMEOUT. Raises subprocess.TimeoutExpired if
+    the deadline has already passed.
+    """
+    deadline = _request_deadline.get()
+    if deadline is None:
+        return SYNTHESIS_TIMEOUT
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise subprocess.TimeoutExpired(PIPER_BIN, 0)
+    return remaining
+
+
+def synthesize_pcm(text: str, voice_model: str, speed: float = 1.0) -> bytes:
+    """
+    Synthesize raw 16-bit mono PCM for text with the given voice model.
+    Uses the in-process voice when loaded, otherwise runs the piper binary.
+    Raises subprocess errors for the caller to handle.
+    """
+    timeout = synthesis_timeout()
+    voice = _loaded_voices.get(voice_model)
+    if voice is not None:
+        length_scale = 1.0 / speed if speed != 1.0 else None
+        return b"".join(voice.synthesize_stream_raw(text, length_scale=length_scale))
+
+    # Piper outputs to stdout, we capture it
+    result = subprocess.run(
+        _piper_command(voice_model, speed),
+        input=text.encode('utf-8'),
+        capture_output=True,
+        check=True,
+        timeout=timeout
+    )
+    return result.stdout
+
+
+# Sentence boundary: whitespace after terminal punctuation (optionally
+# followed by a closing quote/bracket), or a line break
+_SENTENCE_BOUNDARY = re.compile(r'(?:(?<=[.!?…])|(?<=[.!?…]["\'»”)\]]))\s+|\n+')
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences, keeping their punctuation"""
+    return [sentence.strip() for sentence in _SENTENCE_BOUNDARY.split(text) if sentence and sentence.strip()]
+
+
+def iter_speech_pcm(text: str, voice_model: str, speed: float = 1.0,
+                    timeout: Optional[float] = None) -> Iterator[bytes]:
+    """
+    Yield raw PCM for text as it is synthesized, sentence by sentence.
+    With the piper CLI, all sentences go to one process (one per line) and
+    PCM is yielded as piper writes it, always on sample boundaries.
+    timeout defaults to synthesis_timeout().
+    """
+    if timeout is None:
+        timeout = synthesis_timeout()
+    sentences = split_sentences(text)
+    if _loaded_voices.get(voice_model) is not None:
+        for sentence in sentences:
+            yield synthesize_pcm(sentence, voice_model, speed)
+        return
+
+    proc = subprocess.Popen(
+        _piper_command(voice_model, speed),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    killer = threading.Timer(timeout, proc.kill)
+    killer.start()
+    try:
+        proc.stdin.write("\n".join(sentences).encode('utf-8') + b"\n")
+        proc.stdin.close()
+
+        pending = b""
+        while True:
+            chunk = proc.stdout.read1(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            pending += chunk
+            # Never split a 16-bit sample across chunks
+            usable = len(pending) - len(pending) % 2
+            if usable:
+                yield pending[:usable]
+                pending = pending[usable:]
+
+        stderr = proc.stderr.read()
+        returncode = proc.wait()
+    finally:
+        killer.cancel()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+    if returncode < 0:
+        raise subprocess.TimeoutExpired(proc.args, timeout)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, proc.args, stderr=stderr)
+
+
+def resolve_voice_model(language: str) -> Optional[str]:
+    """Voice model for language, or None (with a logged reason) if unusable"""
+    voice_model = VOICE_MODELS.get(language)
+    if not voice_model:
+        print(f"[Piper TTS] Unsupported language: {language}", file=sys.stderr)
+        return None
+    
+    model_file = VOICES_DIR / f"{voice_model}.onnx"
+    if not model_file.exists():
+        print(f"[Piper TTS] Model not found: {model_file}", file=sys.stderr)
+        return None
+    return voice_model
+
+
+def time_stretch(pcm_data: bytes, speed: float, sample_rate: int = DEFAULT_SAMPLE_RATE) -> bytes:
+    """
+    Pitch-preserving time-stretch of 16-bit mono PCM by WSOLA.
+    
+    Output frames are laid down every hop_out samples, each taken from the
+    input around hop_out * speed, shifted by up to +/- tolerance to the
+    position whose waveform best continues the previous frame (maximum
+    cross-correlation, computed per frame with NumPy). Requires numpy.
+    """
+    if speed == 1.0 or not pcm_data:
+        return pcm_data
+
+    frame = int(sample_rate * 0.03)
+    hop_out = frame // 2
+    tolerance = int(sample_rate * 0.01)
+    hop_in = hop_out * speed
+
+    samples = np.frombuffer(pcm_data, dtype="<i2").astype(np.float32)
+    # Pad so every search region and natural continuation is in range
+    padded = np.concatenate([np.zeros(tolerance, np.float32), samples,
+                             np.zeros(frame + 2 * tolerance + hop_out, np.float32)])
+    n_frames = max(1, int(np.ceil(len(samples) / hop_in)))
+    window = np.hanning(frame).astype(np.float32)
+
+    out = np.zeros(n_frames * hop_out + frame, np.float32)
+    norm = np.zeros_like(out)
+    prev = tolerance  # position of the previous frame in padded
+    for k in range(n_frames):
+        target = tolerance + int(k * hop_in)
+        if k:
+            # Natural continuation of the previous frame vs. candidates around target
+            template = padded[prev + hop_out:prev + hop_out + frame]
+            region = padded[target - tolerance:target + tolerance + frame]
+            offset = int(np.argmax(np.correlate(region, template, mode="valid")))
+            target = target - tolerance + offset
+        out[k * hop_out:k * hop_out + frame] += padded[target:target + frame] * window
+        norm[k * hop_out:k * hop_out + frame] += window
+        prev = target
+
+    out_len = int(round(len(samples) / speed))
+    stretched = out[:out_len] / np.maximum(norm[:out_len], 1e-3)
+    return np.clip(stretched, -32768, 32767).astype("<i2").tobytes()
+
+
+def derive_speed_variant(wav_data: bytes, speed: float, audio_format: str = "pcm16") -> bytes:
+    """WAV at speed, time-stretched from a 1.0x 16-bit PCM WAV clip"""
+    (sample_rate,) = struct.unpack_from("<I", wav_data, 24)
+    pcm_data = time_stretch(wav_data[WAV_HEADER_SIZE:], speed, sample_rate)
+    return encode_wav(pcm_data, audio_format, sample_rate)
+
+
+def iter_crossfade(pcm_parts: Iterable[bytes], sample_rate: int = DEFAULT_SAMPLE_RATE) -> Iterator[bytes]:
+    """
+    crossfade_concat() incrementally: each segment's PCM is yielded as soon
+    as the segment arrives, except for its last SEGMENT_CROSSFADE_MS, which
+    are held back to be blended with the start of the next one.
+    """
+    fade = int(sample_rate * SEGMENT_CROSSFADE_MS / 1000)
+    if np is None or not fade:
+        yield from pcm_parts
+        return
+
+    def to_pcm(samples) -> bytes:
+        return np.clip(np.round(samples), -32768, 32767).astype("<i2").tobytes()
+
+    tail = None  # held-back end of the previous segment
+    previous_len = 0  # length of the previous segment, less the part blended into its predecessor
+    for part in pcm_parts:
+        current = np.frombuffer(part, dtype="<i2").astype(np.float32)
+        if tail is not None:
+            overlap = min(fade, previous_len, len(current))
+            ramp = (np.arange(overlap, dtype=np.float32) + 0.5) / max(overlap, 1)
+            blend = tail[len(tail) - overlap:] * (1 - ramp) + current[:overlap] * ramp
+            yield to_pcm(np.concatenate([tail[:len(tail) - overlap], blend]))
+            current = current[overlap:]
+        held = min(fade, len(current))
+        yield to_pcm(current[:len(current) - held])
+        tail, previous_len = current[len(current) - held:], len(current)
+    if tail is not None:
+        yield to_pcm(tail)
+
+
+def crossfade_concat(pcm_parts: List[bytes], sample_rate: int = DEFAULT_SAMPLE_RATE) -> bytes:
+    """
+    Join 16-bit mono PCM segments, overlapping each boundary by a linear
+    crossfade of SEGMENT_CROSSFADE_MS (shorter if a segment is too short).
+    """
+    return b"".join(iter_crossfade(pcm_parts, sample_rate))
+
+
+def resample(pcm_data: bytes, from_rate: int, to_rate: int, taps: int = 63) -> bytes:
+    """
+    Resample 16-bit mono PCM from from_rate to to_rate (requires numpy).
+    
+    When downsampling, a Blackman-windowed sinc low-pass just below the new
+    Nyquist frequency first removes content that would alias; the output
+    samples are then linearly interpolated from the filtered signal.
+    """
+    if from_rate == to_rate or not pcm_data:
+        return pcm_data
+
+    samples = np.frombuffer(pcm_data[:len(pcm_data) - len(pcm_data) % 2], dtype="<i2").astype(np.float32)
+    if to_rate < from_rate:
+        cutoff = 0.475 * to_rate / from_rate  # cycles per input sample
+        n = np.arange(taps) - (taps - 1) / 2
+        kernel = np.sinc(2 * cutoff * n) * np.blackman(taps)
+        samples = np.convolve(samples, (kernel / kernel.sum()).astype(np.float32), mode="same")
+
+    out_len = int(round(len(samples) * to_rate / from_rate))
+    positions = np.arange(out_len) * (from_rate / to_rate)
+    resampled = np.interp(positions, np.arange(len(samples)), samples)
+    return np.clip(np.round(resampled), -32768, 32767).astype("<i2").tobytes()
+
+
+def output_sample_rate(language: str, sample_rate: Optional[int]) -> Optional[int]:
+    """
+    Validated output rate for a request: None when the voice's own rate
+    should be used (nothing requested, or the request matches it).
+    Raises ValueError for rates that cannot be produced.
+    """
+    if not sample_rate:
+        return None
+    sample_rate = int(sample_rate)
+    if not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE:
+        raise ValueError(f"Sample rate must be {MIN_SAMPLE_RATE}-{MAX_SAMPLE_RATE} Hz: {sample_rate}")
+    voice_model = VOICE_MODELS.get(language)
+    if voice_model and sample_rate == get_voice_sample_rate(voice_model):
+        return None
+    if np is None:
+        raise ValueError("Resampling requires numpy")
+    return sample_rate
+
+
+# Aggregated metrics: per-stage histograms {stage: [bucket counts..., sum, count]},
+# request outcomes and failure counters by type
+_stage_histograms: Dict[str, list] = {}
+_outcome_counts: Dict[str, int] = {}
+_failure_counts: Dict[str, int] = {}
+_metrics_lock = threading.Lock()
+
+
+class RequestMetrics:
+    """Per-stage timings for one generate_speech() call (no-op unless METRICS_ENABLED)"""
+
+    def __init__(self, language: str):
+        self.language = language
+        self.stages: Dict[str, float] = {}
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def finish(self, outcome: str, failure: Optional[str] = None) -> None:
+        """Record the request; outcome is 'hit', 'miss' or 'error'"""
+        if not METRICS_ENABLED:
+            return
+        self.stages["total"] = time.perf_counter() - self.started
+
+        with _metrics_lock:
+            for name, seconds in self.stages.items():
+                histogram = _stage_histograms.setdefault(name, [0] * (len(METRICS_BUCKETS) + 2))
+                for i, bound in enumerate(METRICS_BUCKETS):
+                    if seconds <= bound:
+                        histogram[i] += 1
+                histogram[-2] += seconds
+                histogram[-1] += 1
+            _outcome_counts[outcome] = _outcome_counts.get(outcome, 0) + 1
+            if failure:
+                _failure_counts[failure] = _failure_counts.get(failure, 0) + 1
+
+        if METRICS_LOG:
+            line = json.dumps({
+                "ts": time.time(),
+                "language": self.language,
+                "outcome": outcome,
+                "failure": failure,
+                "stages_ms": {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+            })
+            if METRICS_LOG == "-":
+                print(line, file=sys.stderr)
+            else:
+                with open(METRICS_LOG, "a") as log_file:
+                    log_file.write(line + "\n")
+
+
+def export_prometheus() -> str:
+    """Aggregated TTS metrics of this process in Prometheus text format"""
+    lines = [
+        "# HELP piper_tts_stage_seconds Time spent per TTS pipeline stage",
+        "# TYPE piper_tts_stage_seconds histogram",
+    ]
+    with _metrics_lock:
+        for name in sorted(_stage_histograms):
+            histogram = _stage_histograms[name]
+            for bound, count in zip(METRICS_BUCKETS, histogram):
+                lines.append(f'piper_tts_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'piper_tts_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {histogram[-1]}')
+            lines.append(f'piper_tts_stage_seconds_sum{{stage="{name}"}} {histogram[-2]:.6f}')
+            lines.append(f'piper_tts_stage_seconds_count{{stage="{name}"}} {histogram[-1]}')
+
+        lines.append("# HELP piper_tts_requests_total TTS requests by outcome")
+        lines.append("# TYPE piper_tts_requests_total counter")
+        for outcome in sorted(_outcome_counts):
+            lines.append(f'piper_tts_requests_total{{outcome="{outcome}"}} {_outcome_counts[outcome]}')
+
+        lines.append("# HELP piper_tts_failures_total Failed TTS requests by failure type")
+        lines.append("# TYPE piper_tts_failures_total counter")
+        for failure in sorted(_failure_counts):
+            lines.append(f'piper_tts_failures_total{{type="{failure}"}} {_failure_counts[failure]}')
+    return "\n".join(lines) + "\n"
+
+
+def generate_speech(text: str, language: str, speed: float = 1.0, audio_format: str = "pcm16",
+                    sample_rate: Optional[int] = None,
+                    open_file: bool = False) -> Union[bytes, BinaryIO, None]:
     """
     Generate speech using Piper TTS
     
@@ -58,80 +1225,422 @@ def generate_speech(text: str, language: str, speed: float = 1.0) -> Optional[by
         text: Text to synthesize
         language: Language code (e.g., 'es', 'fr', 'de', 'it')
         speed: Speech speed multiplier (0.5-2.0)
+        audio_format: WAV encoding, one of AUDIO_FORMATS
+        sample_rate: Output rate in Hz (default: the voice's own rate)
+        open_file: Return clips stored on disk as an open file rather than
+            reading them into memory (see send_audio)
     
     Returns:
-        WAV audio data as bytes, or None if generation fails
+        WAV audio data as bytes (or an open file), or None if generation fails
     """
+    metrics = RequestMetrics(language)
+    if audio_format not in AUDIO_FORMATS:
+        print(f"[Piper TTS] Unsupported audio format: {audio_format}", file=sys.stderr)
+        metrics.finish("error", "unsupported_format")
+        return None
+    try:
+        sample_rate = output_sample_rate(language, sample_rate)
+    except ValueError as e:
+        print(f"[Piper TTS] {e}", file=sys.stderr)
+        metrics.finish("error", "unsupported_sample_rate")
+        return None
+
     # Check cache first
-    cache_key = get_cache_key(text, language, speed)
-    cached = get_cached_audio(cache_key)
+    with metrics.stage("cache_key"):
+        text = normalize_text(text)
+        speed = quantize_speed(speed)
+    if not is_supported_speed(speed):
+        print(f"[Piper TTS] Unsupported speed: {speed}", file=sys.stderr)
+        metrics.finish("error", "unsupported_speed")
+        return None
+
+    if DERIVE_SPEEDS and speed != 1.0:
+        base = generate_speech(text, language, 1.0, sample_rate=sample_rate)
+        if base is None:
+            metrics.finish("error", "base_clip")
+            return None
+        with metrics.stage("time_stretch"):
+            wav_data = derive_speed_variant(base, speed, audio_format)
+        metrics.finish("derived")
+        return wav_data
+
+    with metrics.stage("cache_key"):
+        cache_key = get_cache_key(text, language, speed, audio_format, sample_rate)
+    with metrics.stage("cache_lookup"):
+        cached = get_cached_audio(cache_key, open_file)
     if cached:
+        metrics.finish("hit")
         return cached
     
     # Get voice model for language
-    voice_model = VOICE_MODELS.get(language)
+    with metrics.stage("model_resolution"):
+        voice_model = resolve_voice_model(language)
     if not voice_model:
-        print(f"[Piper TTS] Unsupported language: {language}", file=sys.stderr)
-        return None
-    
-    model_file = VOICES_DIR / f"{voice_model}.onnx"
-    if not model_file.exists():
-        print(f"[Piper TTS] Model not found: {model_file}", file=sys.stderr)
+        metrics.finish("error", "unsupported_language" if language not in VOICE_MODELS else "model_not_found")
         return None
     
     try:
-        # Generate audio using piper
-        # Piper outputs to stdout, we capture it
-        piper_bin = "/home/ubuntu/piper-venv/bin/piper"
-        cmd = [
-            piper_bin,
-            "--model", str(model_file),
-            "--output_raw",
-        ]
-        
-        # Add length scale for speed control (inverse of speed)
-        # Lower length_scale = faster speech
-        if speed != 1.0:
-            length_scale = 1.0 / speed
-            cmd.extend(["--length_scale", str(length_scale)])
-        
-        result = subprocess.run(
-            cmd,
-            input=text.encode('utf-8'),
-            capture_output=True,
-            check=True,
-            timeout=10
-        )
-        
-        # Piper outputs raw PCM, we need to add WAV header
-        pcm_data = result.stdout
-        wav_data = create_wav_header(pcm_data) + pcm_data
+        # Only one caller synthesizes a given clip; the others wait for it
+        with contextlib.ExitStack() as stack:
+            with metrics.stage("lock_wait"):
+                stack.enter_context(cache_fill_lock(cache_key))
+            cached = _read_cache_file(cache_key)
+            if cached:
+                # Filled by the request we waited for
+                _index_record_hit(cache_key, len(cached), after_miss=True)
+                metrics.finish("hit")
+                return cached
+
+            voice_rate = get_voice_sample_rate(voice_model)
+            segments = split_sentences(text) if SEGMENT_CACHE else []
+            if len(segments) > 1:
+                with metrics.stage("segments"):
+                    pcm_data = assemble_segments(segments, language, voice_model, speed, sample_rate)
+            else:
+                # Piper outputs raw PCM, we need to add WAV header
+                with metrics.stage("synthesis"):
+                    pcm_data = synthesize_pcm(text, voice_model, speed)
+                if sample_rate:
+                    with metrics.stage("resample"):
+                        pcm_data = resample(pcm_data, voice_rate, sample_rate)
+            with metrics.stage("encode"):
+                wav_parts = encode_wav_parts(pcm_data, audio_format, sample_rate or voice_rate)
+            
+            # Cache the result
+            with metrics.stage("cache_write"):
+                save_to_cache(cache_key, wav_parts, language, voice_model, text, speed,
+                              audio_format, sample_rate)
         
-        # Cache the result
-        save_to_cache(cache_key, wav_data)
-        
-        return wav_data
+        metrics.finish("miss")
+        # Serve a fresh clip from the file just written rather than joining its parts
+        wav_data = _open_cache_file(cache_key) if open_file else None
+        return wav_data or b"".join(wav_parts)
         
     except subprocess.TimeoutExpired:
         print(f"[Piper TTS] Timeout generating speech for: {text[:50]}", file=sys.stderr)
+        metrics.finish("error", "timeout")
         return None
     except subprocess.CalledProcessError as e:
         print(f"[Piper TTS] Error: {e.stderr.decode()}", file=sys.stderr)
+        metrics.finish("error", "called_process_error")
         return None
     except Exception as e:
         print(f"[Piper TTS] Unexpected error: {e}", file=sys.stderr)
+        metrics.finish("error", "other")
         return None
 
 
-def create_wav_header(pcm_data: bytes, sample_rate: int = 22050, channels: int = 1, bits_per_sample: int = 16) -> bytes:
-    """Create WAV file header for PCM data"""
-    import struct
+# Shared by all requests of this process (recreated after a fork)
+_segment_executor: Optional[ThreadPoolExecutor] = None
+_segment_executor_pid = 0
+_segment_executor_lock = threading.Lock()
+
+
+def get_segment_executor() -> ThreadPoolExecutor:
+    """Thread pool rendering sentences of multi-sentence texts"""
+    global _segment_executor, _segment_executor_pid
+    with _segment_executor_lock:
+        if _segment_executor is None or _segment_executor_pid != os.getpid():
+            _segment_executor = ThreadPoolExecutor(max_workers=SEGMENT_WORKERS,
+                                                   thread_name_prefix="piper-segment")
+            _segment_executor_pid = os.getpid()
+        return _segment_executor
+
+
+def _synthesize_group_cli(texts: List[str], voice_model: str, speed: float) -> List[bytes]:
+    """
+    Synthesize several texts with one piper process (one model load) using
+    its JSON input mode, which writes each line's audio to its own file.
+    Returns raw PCM per text, in order.
+    """
+    with tempfile.TemporaryDirectory(prefix="piper-batch-") as tmp_dir:
+        outputs = [os.path.join(tmp_dir, f"{i}.wav") for i in range(len(texts))]
+        lines = "".join(
+            json.dumps({"text": text, "output_file": output}) + "\n"
+            for text, output in zip(texts, outputs)
+        )
+        cmd = [arg for arg in _piper_command(voice_model, speed) if arg != "--output_raw"]
+        subprocess.run(
+            cmd + ["--json-input"],
+            input=lines.encode('utf-8'),
+            capture_output=True,
+            check=True,
+            timeout=SYNTHESIS_TIMEOUT * len(texts) if _request_deadline.get() is None else synthesis_timeout()
+        )
+
+        pcm = []
+        for output in outputs:
+            with wave.open(output, "rb") as wav_file:
+                pcm.append(wav_file.readframes(wav_file.getnframes()))
+        return pcm
+
+
+def synthesize_pcm_group(texts: List[str], voice_model: str, speed: float = 1.0) -> List[bytes]:
+    """
+    Raw PCM for several texts with a single model load: the in-process
+    voice when loaded (concurrently on SEGMENT_WORKERS threads; inference
+    runs outside the GIL), otherwise one piper process for all texts.
+    Raises subprocess errors for the caller to handle.
+    """
+    if _loaded_voices.get(voice_model) is not None:
+        if SEGMENT_WORKERS > 1 and len(texts) > 1:
+            deadline = _request_deadline.get()
+
+            def render(text: str) -> bytes:
+                # Pool threads do not inherit the caller's context
+                with request_deadline(deadline):
+                    return synthesize_pcm(text, voice_model, speed)
+
+            return list(get_segment_executor().map(render, texts))
+        return [synthesize_pcm(text, voice_model, speed) for text in texts]
+    if len(texts) == 1:
+        return [synthesize_pcm(texts[0], voice_model, speed)]
+    return _synthesize_group_cli(texts, voice_model, speed)
+
+
+def iter_segment_pcm(segments: List[str], language: str, voice_model: str, speed: float,
+                     sample_rate: Optional[int] = None, early_first: bool = False) -> Iterator[bytes]:
+    """
+    16-bit PCM of each sentence, in order. Every sentence is served from
+    (or added to) the cache as a clip of its own, so only sentences not
+    seen before are synthesized, all in one synthesize_pcm_group() call.
+    With early_first (streaming), the first missing sentence is synthesized
+    on its own and yielded before the others are rendered.
+    sample_rate is the validated output rate (None = the voice's own).
+    Raises subprocess errors for the caller to handle.
+    """
+    keys = [get_cache_key(segment, language, speed, "pcm16", sample_rate) for segment in segments]
+    clips = [get_cached_audio(cache_key) for cache_key in keys]
+    # Repeated sentences are synthesized once: {cache_key: positions}
+    missing: Dict[str, List[int]] = {}
+    for i, clip in enumerate(clips):
+        if clip is None:
+            missing.setdefault(keys[i], []).append(i)
+
+    def fill(cache_keys: List[str]) -> None:
+        voice_rate = get_voice_sample_rate(voice_model)
+        texts = [segments[missing[cache_key][0]] for cache_key in cache_keys]
+        for cache_key, text, pcm_data in zip(cache_keys, texts, synthesize_pcm_group(texts, voice_model, speed)):
+            if sample_rate:
+                pcm_data = resample(pcm_data, voice_rate, sample_rate)
+            clip = _fill_cache(cache_key, encode_wav(pcm_data, "pcm16", sample_rate or voice_rate),
+                               language, voice_model, text, speed, "pcm16", sample_rate)
+            for i in missing[cache_key]:
+                clips[i] = clip
+
+    # Missing sentences in text order, split into the groups rendered together
+    groups = [list(missing)]
+    if early_first and len(missing) > 1:
+        groups = [groups[0][:1], groups[0][1:]]
+    for i in range(len(clips)):
+        if clips[i] is None:
+            fill(groups.pop(0))
+        yield clips[i][WAV_HEADER_SIZE:]
+
+
+def assemble_segments(segments: List[str], language: str, voice_model: str, speed: float,
+                      sample_rate: Optional[int] = None) -> bytes:
+    """
+    PCM for consecutive sentences (see iter_segment_pcm), joined by
+    crossfades, at sample_rate (None = the voice's own). Raises subprocess
+    errors for the caller to handle.
+    """
+    pcm_parts = list(iter_segment_pcm(segments, language, voice_model, speed, sample_rate))
+    return crossfade_concat(pcm_parts, sample_rate or get_voice_sample_rate(voice_model))
+
+
+def generate_speech_batch(requests: List[Dict[str, any]]) -> List[Optional[bytes]]:
+    """
+    Generate speech for many {text, language, speed, format, sample_rate}
+    requests at once.
     
+    Cache hits are served directly; multi-sentence texts go through
+    generate_speech() so they are assembled from the segment cache exactly
+    like single requests. Other misses are grouped by voice model and
+    speed so each model is loaded once per batch (in-process when piper-tts
+    is available, otherwise one piper process per group). Every result is
+    cached under the fill lock. Returns WAV data per request, None where generation failed.
+    """
+    speeds: List[Optional[float]] = []
+    for request in requests:
+        speed = request.get("speed", 1.0)
+        speed = quantize_speed(speed) if _is_number(speed) else None
+        speeds.append(speed if speed is not None and is_supported_speed(speed) else None)
+    if DERIVE_SPEEDS and any(speed not in (1.0, None) for speed in speeds):
+        base = generate_speech_batch([
+            dict(request, speed=1.0, format="pcm16" if speed != 1.0 else request.get("format", "pcm16"))
+            for request, speed in zip(requests, speeds)
+        ])
+        return [
+            None if speed is None
+            else derive_speed_variant(wav_data, speed, request.get("format", "pcm16"))
+            if wav_data and speed != 1.0 else wav_data
+            for wav_data, speed, request in zip(base, speeds, requests)
+        ]
+
+    results: List[Optional[bytes]] = [None] * len(requests)
+    groups: Dict[Tuple[str, float], List[int]] = {}
+    keys: List[Optional[str]] = [None] * len(requests)
+    texts: List[Optional[str]] = [None] * len(requests)
+    formats = [request.get("format", "pcm16") for request in requests]
+    rates: List[Optional[int]] = [None] * len(requests)
+
+    for i, request in enumerate(requests):
+        text = normalize_text(request.get("text") or "")
+        language = request.get("language")
+        if not text or not language:
+            print(f"[Piper TTS] Batch item {i}: missing text or language", file=sys.stderr)
+            continue
+        if formats[i] not in AUDIO_FORMATS:
+            print(f"[Piper TTS] Batch item {i}: unsupported audio format {formats[i]}", file=sys.stderr)
+            continue
+        try:
+            rates[i] = output_sample_rate(language, request.get("sample_rate"))
+        except ValueError as e:
+            print(f"[Piper TTS] Batch item {i}: {e}", file=sys.stderr)
+            continue
+        speed = speeds[i]
+        if speed is None:
+            print(f"[Piper TTS] Batch item {i}: unsupported speed {request.get('speed')!r}", file=sys.stderr)
+            continue
+        texts[i] = text
+        keys[i] = get_cache_key(text, language, speed, formats[i], rates[i])
+        cached = get_cached_audio(keys[i])
+        if cached:
+            results[i] = cached
+            continue
+        if SEGMENT_CACHE and len(split_sentences(text)) > 1:
+            # Same segment-cached, crossfaded clip (under the fill lock) as a single request
+            results[i] = generate_speech(text, language, speed, formats[i], request.get("sample_rate"))
+            continue
+        voice_model = resolve_voice_model(language)
+        if voice_model:
+            groups.setdefault((voice_model, speed), []).append(i)
+
+    for (voice_model, speed), indices in groups.items():
+        group_texts = [texts[i] for i in indices]
+        try:
+            if load_voice(voice_model):
+                pcm_parts = [synthesize_pcm(text, voice_model, speed) for text in group_texts]
+            else:
+                pcm_parts = _synthesize_group_cli(group_texts, voice_model, speed)
+        except subprocess.TimeoutExpired:
+            print(f"[Piper TTS] Timeout in batch for {voice_model}", file=sys.stderr)
+            continue
+        except subprocess.CalledProcessError as e:
+            print(f"[Piper TTS] Error: {e.stderr.decode()}", file=sys.stderr)
+            continue
+        except Exception as e:
+            print(f"[Piper TTS] Unexpected error in batch for {voice_model}: {e}", file=sys.stderr)
+            continue
+
+        voice_rate = get_voice_sample_rate(voice_model)
+        for i, pcm_data in zip(indices, pcm_parts):
+            if rates[i]:
+                pcm_data = resample(pcm_data, voice_rate, rates[i])
+            results[i] = _fill_cache(keys[i], encode_wav(pcm_data, formats[i], rates[i] or voice_rate),
+                                     requests[i]["language"], voice_model, texts[i], speed,
+                                     formats[i], rates[i])
+
+    return results
+
+
+def stream_speech(text: str, language: str, write: Callable[[bytes], None],
+                  speed: float = 1.0, framed: bool = False) -> bool:
+    """
+    Synthesize text sentence by sentence, passing audio to write() as soon
+    as each part is ready.
+    
+    By default the output is one WAV stream: a header with unknown
+    (0xFFFFFFFF) sizes followed by PCM. With framed=True every chunk is sent
+    as a 4-byte big-endian length plus payload; the first frame is the WAV
+    header and an empty frame marks the end. Audio is always at the voice's
+    own sample rate.
+    
+    Synthesis happens under the same fill lock as generate_speech(). With
+    SEGMENT_CACHE, multi-sentence texts are streamed from the segment cache,
+    so the complete clip equals generate_speech()'s and is cached under its
+    key; otherwise all sentences go to one piper process, whose output is
+    cached only for single-sentence texts. Returns False on failure.
+    """
+    def emit(chunk: bytes) -> None:
+        write(struct.pack(">I", len(chunk)) + chunk if framed else chunk)
+
+    def emit_clip(wav_data: bytes) -> None:
+        wav_data = memoryview(wav_data)
+        emit(wav_data[:WAV_HEADER_SIZE])
+        emit(wav_data[WAV_HEADER_SIZE:])
+        if framed:
+            emit(b"")
+
+    text = normalize_text(text)
+    speed = quantize_speed(speed)
+    if not is_supported_speed(speed):
+        print(f"[Piper TTS] Unsupported speed: {speed}", file=sys.stderr)
+        return False
+    cache_key = get_cache_key(text, language, speed)
+    cached = get_cached_audio(cache_key)
+    if cached:
+        emit_clip(cached)
+        return True
+
+    voice_model = resolve_voice_model(language)
+    if not voice_model:
+        return False
+
+    sample_rate = get_voice_sample_rate(voice_model)
+    segments = split_sentences(text)
+    pcm_parts = []
+    try:
+        with cache_fill_lock(cache_key):
+            cached = _read_cache_file(cache_key)
+            if cached:
+                # Filled by the request we waited for
+                _index_record_hit(cache_key, len(cached), after_miss=True)
+                emit_clip(cached)
+                return True
+
+            emit(create_wav_header(b"", sample_rate, data_size=WAV_STREAMING_SIZE))
+            if SEGMENT_CACHE and len(segments) > 1:
+                pcm_chunks = iter_crossfade(
+                    iter_segment_pcm(segments, language, voice_model, speed, early_first=True), sample_rate)
+            else:
+                pcm_chunks = iter_speech_pcm(text, voice_model, speed)
+            for pcm in pcm_chunks:
+                if pcm:
+                    pcm_parts.append(pcm)
+                    emit(pcm)
+            if framed:
+                emit(b"")
+
+            if SEGMENT_CACHE or len(segments) <= 1:
+                pcm_data = b"".join(pcm_parts)
+                save_to_cache(cache_key, create_wav_header(pcm_data, sample_rate) + pcm_data,
+                              language, voice_model, text, speed)
+    except subprocess.TimeoutExpired:
+        print(f"[Piper TTS] Timeout generating speech for: {text[:50]}", file=sys.stderr)
+        return False
+    except subprocess.CalledProcessError as e:
+        print(f"[Piper TTS] Error: {e.stderr.decode()}", file=sys.stderr)
+        return False
+    except Exception as e:
+        print(f"[Piper TTS] Unexpected error: {e}", file=sys.stderr)
+        return False
+    return True
+
+
+def create_wav_header(pcm_data: bytes, sample_rate: int = DEFAULT_SAMPLE_RATE, channels: int = 1, bits_per_sample: int = 16,
+                      data_size: Optional[int] = None) -> bytes:
+    """
+    Create WAV file header for PCM data
+    (data_size overrides len(pcm_data), e.g. WAV_STREAMING_SIZE)
+    """
     # Calculate sizes
     byte_rate = sample_rate * channels * bits_per_sample // 8
     block_align = channels * bits_per_sample // 8
-    data_size = len(pcm_data)
-    file_size = data_size + 36
+    if data_size is None:
+        data_size = len(pcm_data)
+    file_size = min(data_size + 36, WAV_STREAMING_SIZE)
     
     # Build WAV header
     header = b''
@@ -152,44 +1661,942 @@ def create_wav_header(pcm_data: bytes, sample_rate: int = 22050, channels: int =
     return header
 
 
+def _wav_container(fmt_chunk: bytes, data: bytes, sample_count: int) -> List[bytes]:
+    """RIFF/WAVE file with the given fmt chunk body, a fact chunk and data, as [headers, data]"""
+    chunks = (
+        b'WAVE'
+        + b'fmt ' + struct.pack('<I', len(fmt_chunk)) + fmt_chunk
+        + b'fact' + struct.pack('<II', 4, sample_count)
+        + b'data' + struct.pack('<I', len(data))
+    )
+    padding = b'\0' if len(data) % 2 else b''  # chunks are word aligned
+    riff_size = len(chunks) + len(data) + len(padding)
+    parts = [b'RIFF' + struct.pack('<I', riff_size) + chunks, data]
+    if padding:
+        parts.append(padding)
+    return parts
+
+
+def _pcm_samples(pcm_data: bytes) -> array.array:
+    """16-bit little-endian PCM as an array of ints"""
+    samples = array.array('h', pcm_data[:len(pcm_data) - len(pcm_data) % 2])
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples
+
+
+_ulaw_table: Optional[bytes] = None
+
+
+def _ulaw_lookup_table() -> bytes:
+    """G.711 µ-law code for every 16-bit sample value (index = sample + 32768)"""
+    global _ulaw_table
+    if _ulaw_table is None:
+        codes = bytearray(65536)
+        for value in range(-32768, 32768):
+            sign = 0x80 if value < 0 else 0
+            magnitude = min(-value if value < 0 else value, 32635) + 0x84
+            exponent = (magnitude >> 7).bit_length() - 1
+            mantissa = (magnitude >> (exponent + 3)) & 0x0F
+            codes[value + 32768] = ~(sign | (exponent << 4) | mantissa) & 0xFF
+        _ulaw_table = bytes(codes)
+    return _ulaw_table
+
+
+def encode_ulaw(pcm_data: bytes) -> bytes:
+    """16-bit PCM to 8-bit G.711 µ-law"""
+    table = _ulaw_lookup_table()
+    if np is not None:
+        samples = np.frombuffer(pcm_data[:len(pcm_data) - len(pcm_data) % 2], dtype='<i2')
+        return np.frombuffer(table, dtype=np.uint8)[samples.astype(np.int32) + 32768].tobytes()
+    return bytes(table[sample + 32768] for sample in _pcm_samples(pcm_data))
+
+
+_ADPCM_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+    12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767,
+)
+_ADPCM_INDEX_ADJUST = (-1, -1, -1, -1, 2, 4, 6, 8) * 2
+
+
+def encode_ima_adpcm(pcm_data: bytes, block_align: int = ADPCM_BLOCK_ALIGN) -> Tuple[bytes, int]:
+    """
+    16-bit mono PCM to IMA-ADPCM blocks as stored in WAV (format 0x11).
+    Each block starts with the uncompressed first sample and step index,
+    followed by 4-bit codes, low nibble first. The final block is padded
+    with silence. Returns (data, samples_per_block).
+    
+    Runs sample by sample in Python, about 0.8 s per 30 s of audio, holding
+    the GIL throughout; see enable_adpcm_offload().
+    """
+    samples_per_block = (block_align - 4) * 2 + 1
+    samples = _pcm_samples(pcm_data)
+    out = bytearray()
+    index = 0
+
+    for start in range(0, len(samples), samples_per_block):
+        block = samples[start:start + samples_per_block]
+        if len(block) < samples_per_block:
+            block.extend([0] * (samples_per_block - len(block)))
+        predictor = block[0]
+        out += struct.pack('<hBB', predictor, index, 0)
+
+        nibbles = []
+        for sample in block[1:]:
+            step = _ADPCM_STEPS[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code = 8
+                diff = -diff
+            delta = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                code |= 2
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                code |= 1
+                delta += step
+
+            predictor = predictor - delta if code & 8 else predictor + delta
+            predictor = max(-32768, min(32767, predictor))
+            index = max(0, min(88, index + _ADPCM_INDEX_ADJUST[code]))
+            nibbles.append(code)
+
+        out += bytes(low | (high << 4) for low, high in zip(nibbles[0::2], nibbles[1::2]))
+    return bytes(out), samples_per_block
+
+
+# Helper processes for long ADPCM encodes, enabled by the threaded servers
+_adpcm_offload = False
+_adpcm_executor: Optional[ProcessPoolExecutor] = None
+_adpcm_executor_lock = threading.Lock()
+
+
+def enable_adpcm_offload() -> None:
+    """Encode long ADPCM clips in helper processes (threaded server modes)"""
+    global _adpcm_offload
+    _adpcm_offload = ADPCM_OFFLOAD_BYTES > 0
+
+
+def get_adpcm_executor() -> ProcessPoolExecutor:
+    """Process pool for encode_ima_adpcm, started with forkserver (safe from threaded servers)"""
+    global _adpcm_executor
+    with _adpcm_executor_lock:
+        if _adpcm_executor is None:
+            _adpcm_executor = ProcessPoolExecutor(max_workers=ADPCM_OFFLOAD_WORKERS,
+                                                  mp_context=multiprocessing.get_context("forkserver"))
+        return _adpcm_executor
+
+
+def encode_ima_adpcm_offloaded(pcm_data: bytes) -> Tuple[bytes, int]:
+    """
+    encode_ima_adpcm() in a helper process for PCM above ADPCM_OFFLOAD_BYTES
+    once enable_adpcm_offload() was called, so the calling thread waits
+    without holding the GIL. Otherwise, or if the helper cannot run,
+    encodes in the calling thread.
+    """
+    if _adpcm_offload and len(pcm_data) > ADPCM_OFFLOAD_BYTES:
+        try:
+            return get_adpcm_executor().submit(encode_ima_adpcm, pcm_data).result()
+        except (OSError, BrokenProcessPool) as e:
+            global _adpcm_executor
+            with _adpcm_executor_lock:
+                _adpcm_executor = None  # start a fresh pool next time
+            print(f"[Piper TTS] ADPCM helper unavailable, encoding in-thread: {e}", file=sys.stderr)
+    return encode_ima_adpcm(pcm_data)
+
+
+def encode_wav(pcm_data: bytes, audio_format: str = "pcm16", sample_rate: int = DEFAULT_SAMPLE_RATE) -> bytes:
+    """Complete WAV file for 16-bit mono PCM in the requested AUDIO_FORMATS encoding"""
+    return b"".join(encode_wav_parts(pcm_data, audio_format, sample_rate))
+
+
+def encode_wav_parts(pcm_data: bytes, audio_format: str = "pcm16",
+                     sample_rate: int = DEFAULT_SAMPLE_RATE) -> List[bytes]:
+    """
+    encode_wav() as a list of parts (header, audio data), so the audio can
+    be written out without copying it into one buffer with the header
+    """
+    if audio_format == "pcm16":
+        return [create_wav_header(pcm_data, sample_rate), pcm_data]
+
+    sample_count = len(pcm_data) // 2
+    if audio_format == "ulaw":
+        # WAVE_FORMAT_MULAW: 8 bits per sample, cbSize 0
+        fmt_chunk = struct.pack('<HHIIHHH', 7, 1, sample_rate, sample_rate, 1, 8, 0)
+        return _wav_container(fmt_chunk, encode_ulaw(pcm_data), sample_count)
+    if audio_format == "adpcm":
+        data, samples_per_block = encode_ima_adpcm_offloaded(pcm_data)
+        byte_rate = sample_rate * ADPCM_BLOCK_ALIGN // samples_per_block
+        # WAVE_FORMAT_IMA_ADPCM: 4 bits per sample, cbSize 2 + samplesPerBlock
+        fmt_chunk = struct.pack('<HHIIHHHH', 0x11, 1, sample_rate, byte_rate,
+                                ADPCM_BLOCK_ALIGN, 4, 2, samples_per_block)
+        return _wav_container(fmt_chunk, data, sample_count)
+    raise ValueError(f"Unsupported audio format: {audio_format}")
+
+
 def clear_cache() -> int:
     """Clear all cached audio files. Returns number of files deleted."""
     count = 0
-    for cache_file in CACHE_DIR.glob("*.wav"):
-        cache_file.unlink()
+    removed = []
+    for entry in iter_cache_files():
+        os.unlink(entry.path)
+        removed.append(entry.name[:-len(".wav")])
         count += 1
+    _index_remove(removed)
+    _index_record_invalidation()
     return count
 
 
+def _index_record_invalidation() -> None:
+    """Tell other processes' hot tiers that cached clips were invalidated"""
+    get_cache_index().execute("UPDATE totals SET value = value + 1 WHERE name = 'invalidations'")
+
+
+def invalidate_cache(voice_model: Optional[str] = None, language: Optional[str] = None,
+                     older_than: Optional[float] = None,
+                     text_filter: Optional[Callable[[str], bool]] = None,
+                     batch_size: int = 256, pause: float = 0.0) -> int:
+    """
+    Delete the cached clips matching every given filter, found through the
+    cache index:
+        voice_model: clips synthesized by this voice (e.g. after upgrading it)
+        language: clips for this language code, including its regional
+            variants ('de' also matches 'de-DE')
+        older_than: clips created more than this many seconds ago
+        text_filter: predicate on the clip's text
+    
+    Clips are deleted in batches of batch_size, each in its own index
+    transaction, sleeping pause seconds in between, so serving is never
+    stalled behind one long delete. Clips adopted from disk have no
+    recorded voice, language or text and only match on age.
+    Returns number of clips deleted.
+    """
+    conditions, params = [], []
+    if voice_model:
+        conditions.append("voice_model = ?")
+        params.append(voice_model)
+    if language:
+        conditions.append("(language = ? OR language LIKE ?)")
+        params.extend([language, language + "-%"])
+    if older_than is not None:
+        conditions.append("created_at < ?")
+        params.append(time.time() - older_than)
+    if text_filter is not None:
+        conditions.append("text IS NOT NULL")
+    where = " AND ".join(conditions) or "1"
+
+    conn = get_cache_index()
+    deleted = 0
+    last_rowid = 0
+    while True:
+        batch = conn.execute(
+            f"SELECT rowid, cache_key, text FROM entries WHERE rowid > ? AND {where} ORDER BY rowid LIMIT ?",
+            [last_rowid, *params, batch_size],
+        ).fetchall()
+        if not batch:
+            break
+        last_rowid = batch[-1][0]
+        victims = [cache_key for _, cache_key, text in batch if text_filter is None or text_filter(text)]
+        for cache_key in victims:
+            _unlink_cached(cache_key)
+        if victims:
+            _index_remove(victims)
+            deleted += len(victims)
+        if pause:
+            time.sleep(pause)
+
+    if deleted:
+        _index_record_invalidation()
+    return deleted
+
+
 def get_cache_stats() -> Dict[str, any]:
-    """Get cache statistics"""
-    files = list(CACHE_DIR.glob("*.wav"))
-    total_size = sum(f.stat().st_size for f in files)
+    """Get cache statistics from the cache index (no directory walk)"""
+    flush_hot_cache_hits()
+    conn = get_cache_index()
+    totals = _index_totals(conn)
+    lookups = totals["hits"] + totals["misses"]
+    languages = {
+        (language or "unknown"): {
+            "file_count": entries,
+            "total_size_mb": round(size / (1024 * 1024), 2),
+        }
+        for language, entries, size in conn.execute(
+            "SELECT language, entries, bytes FROM language_totals WHERE entries > 0"
+        )
+    }
     return {
-        "file_count": len(files),
-        "total_size_mb": round(total_size / (1024 * 1024), 2),
+        "file_count": int(totals["entries"]),
+        "total_size_mb": round(totals["bytes"] / (1024 * 1024), 2),
         "cache_dir": str(CACHE_DIR),
+        "languages": languages,
+        "hits": int(totals["hits"]),
+        "misses": int(totals["misses"]),
+        "hit_rate": round(totals["hits"] / lookups, 4) if lookups else None,
+        "last_access": totals["last_access"] or None,
+        "hot_tier": _hot_cache.stats() if _hot_cache is not None else None,
     }
 
 
-if __name__ == "__main__":
+# Daemon protocol: every message is a 4-byte big-endian length followed by
+# the payload. Requests are JSON objects ({"text", "language", "speed",
+# "format", "sample_rate", "timeout", "priority"}); responses start with a
+# status byte (STATUS_OK / STATUS_ERROR / STATUS_BUSY) followed by the WAV
+# data or a UTF-8 error message. STATUS_BUSY means the request was rejected
+# without being queued, so it can be retried elsewhere.
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_BUSY = 2
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+# Queue order of the async front-end: lower runs first
+REQUEST_PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def parse_speak_request(request: Dict[str, any]) -> Tuple[str, str, float, Optional[float], int]:
+    """
+    Validated (text, language, speed, timeout, priority) of a speak or
+    stream request; timeout is None when not given. Raises ValueError with
+    a message for the client when a field has the wrong type or range.
+    """
+    text = request.get("text")
+    language = request.get("language")
+    if not text or not language:
+        raise ValueError("Missing text or language")
+    if not isinstance(text, str) or not isinstance(language, str):
+        raise ValueError("text and language must be strings")
+    speed = request.get("speed", 1.0)
+    if not _is_number(speed) or not is_supported_speed(quantize_speed(speed)):
+        raise ValueError(f"speed must be a number from {MIN_SPEED} to {MAX_SPEED}: {speed!r}")
+    timeout = request.get("timeout")
+    if timeout is not None and (not _is_number(timeout) or timeout <= 0):
+        raise ValueError(f"timeout must be a positive number of seconds: {timeout!r}")
+    priority = request.get("priority", "interactive")
+    if not isinstance(priority, str) or priority not in REQUEST_PRIORITIES:
+        raise ValueError(f"Unknown priority: {priority!r}")
+    if not isinstance(request.get("format", "pcm16"), str):
+        raise ValueError("format must be a string")
+    sample_rate = request.get("sample_rate")
+    if sample_rate is not None and (not isinstance(sample_rate, int) or isinstance(sample_rate, bool)):
+        raise ValueError(f"sample_rate must be an integer: {sample_rate!r}")
+    return text, language, float(speed), timeout, REQUEST_PRIORITIES[priority]
+
+
+def parse_invalidate_request(request: Dict[str, any]) -> Tuple[Optional[str], Optional[str], Optional[float],
+                                                               Optional[Callable[[str], bool]]]:
+    """
+    Validated (voice_model, language, older_than, text_filter) filters of
+    an invalidate request. Raises ValueError with a message for the client
+    when a field has the wrong type or range, or no filter is given.
+    """
+    voice_model = request.get("voice_model")
+    language = request.get("language")
+    for name, value in (("voice_model", voice_model), ("language", language)):
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{name} must be a string: {value!r}")
+    older_than = request.get("older_than")
+    if older_than is not None and (not _is_number(older_than) or older_than < 0):
+        raise ValueError(f"older_than must be a non-negative number of seconds: {older_than!r}")
+    text_match = request.get("text_match")
+    if text_match is not None and not isinstance(text_match, str):
+        raise ValueError(f"text_match must be a string: {text_match!r}")
+    try:
+        text_filter = re.compile(text_match).search if text_match else None
+    except re.error as e:
+        raise ValueError(f"Invalid text_match: {e}")
+    if not (voice_model or language or older_than is not None or text_filter):
+        raise ValueError("No invalidation filter given")
+    return voice_model or None, language or None, older_than, text_filter
+
+
+def recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    """Read exactly size bytes, or None if the peer closed the connection"""
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            return None
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def read_frame(sock: socket.socket) -> Optional[bytes]:
+    """Read one length-prefixed frame, or None on EOF"""
+    header = recv_exact(sock, 4)
+    if header is None:
+        return None
+    (size,) = struct.unpack(">I", header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame too large: {size} bytes")
+    return recv_exact(sock, size)
+
+
+def write_frame(sock: socket.socket, payload: bytes) -> None:
+    """Write one length-prefixed frame"""
+    sock.sendall(struct.pack(">I", len(payload)) + payload)
+
+
+def write_response(sock: socket.socket, status: int, payload: Union[bytes, BinaryIO]) -> None:
+    """
+    Write one status-prefixed response frame without copying the payload:
+    bytes are sent after the frame header, open clip files with sendfile.
+    """
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        sock.sendall(struct.pack(">IB", len(payload) + 1, status))
+        sock.sendall(payload)
+        return
+    with payload:
+        size = os.fstat(payload.fileno()).st_size
+        sock.sendall(struct.pack(">IB", size + 1, status))
+        sock.sendfile(payload)
+
+
+def _write_all(fd: int, data: memoryview) -> None:
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def send_audio(audio: Union[bytes, BinaryIO], fd: int) -> None:
+    """
+    Write a clip to a file descriptor (pipe, file or socket) without
+    copying it in user space. Open clip files go through os.sendfile, or
+    are memory-mapped and written in STREAM_CHUNK_SIZE slices where the
+    descriptor does not support sendfile; the file is closed afterwards.
+    """
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        _write_all(fd, memoryview(audio))
+        return
+
+    with audio:
+        size = os.fstat(audio.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                sent = os.sendfile(fd, audio.fileno(), offset, size - offset)
+                if not sent:
+                    return
+                offset += sent
+            return
+        except OSError as e:
+            if offset or e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                raise
+        if not size:
+            return
+        with mmap.mmap(audio.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for start in range(0, size, STREAM_CHUNK_SIZE):
+                    _write_all(fd, view[start:start + STREAM_CHUNK_SIZE])
+            finally:
+                view.release()
+
+
+def handle_request(request: Dict[str, any],
+                   deadline: Optional[float] = None) -> Tuple[int, Union[bytes, BinaryIO]]:
+    """
+    Execute a decoded daemon request, returning (status, payload). Audio
+    from disk is an open file, to be sent with write_response().
+    Synthesis is bounded by deadline (time.monotonic() seconds), by
+    default the request's "timeout" seconds from now.
+    """
+    if not isinstance(request, dict):
+        return STATUS_ERROR, b"Request must be a JSON object"
+    op = request.get("op", "speak")
+    if op != "speak":
+        try:
+            if op == "stats":
+                return STATUS_OK, json.dumps(get_cache_stats()).encode()
+            if op == "metrics":
+                return STATUS_OK, export_prometheus().encode()
+            if op == "invalidate":
+                deleted = invalidate_cache(*parse_invalidate_request(request))
+                return STATUS_OK, json.dumps({"deleted": deleted}).encode()
+        except ValueError as e:
+            return STATUS_ERROR, str(e).encode()
+        except Exception as e:
+            print(f"[Piper TTS] {op} failed: {e}", file=sys.stderr)
+            return STATUS_ERROR, f"{op} failed: {e}".encode()
+        return STATUS_ERROR, f"Unknown op: {op}".encode()
+
+    try:
+        text, language, speed, timeout, _ = parse_speak_request(request)
+    except ValueError as e:
+        return STATUS_ERROR, str(e).encode()
+
+    if deadline is None and timeout:
+        deadline = time.monotonic() + timeout
+    with request_deadline(deadline):
+        audio = generate_speech(text, language, speed,
+                                request.get("format", "pcm16"), request.get("sample_rate"),
+                                open_file=True)
+    if audio is None:
+        return STATUS_ERROR, b"Failed to generate audio"
+    return STATUS_OK, audio
+
+
+class TTSRequestHandler(socketserver.BaseRequestHandler):
+    """Serves framed requests on one connection until the client disconnects"""
+
+    def handle(self) -> None:
+        while True:
+            try:
+                frame = read_frame(self.request)
+                if frame is None:
+                    return
+                request = json.loads(frame)
+                if isinstance(request, dict) and request.get("op") == "stream":
+                    self.handle_stream(request)
+                    continue
+                status, payload = handle_request(request)
+            except (ValueError, ConnectionError) as e:
+                # Malformed frame or JSON: report and drop the connection
+                try:
+                    write_frame(self.request, bytes([STATUS_ERROR]) + str(e).encode())
+                except OSError:
+                    pass
+                return
+            write_response(self.request, status, payload)
+
+    def handle_stream(self, request: Dict[str, any]) -> None:
+        """
+        Stream one clip: a STATUS_OK frame per audio chunk (WAV header
+        first), then an empty STATUS_OK frame, or a STATUS_ERROR frame.
+        """
+        try:
+            text, language, speed, _, _ = parse_speak_request(request)
+        except ValueError as e:
+            write_frame(self.request, bytes([STATUS_ERROR]) + str(e).encode())
+            return
+
+        ok = stream_speech(
+            text, language,
+            lambda chunk: write_frame(self.request, bytes([STATUS_OK]) + chunk),
+            speed,
+        )
+        if ok:
+            write_frame(self.request, bytes([STATUS_OK]))
+        else:
+            write_frame(self.request, bytes([STATUS_ERROR]) + b"Failed to generate audio")
+
+
+class TTSDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TTSWorkerServer(socketserver.UnixStreamServer):
+    """Single-threaded server run inside each pre-forked pool worker"""
+
+
+def _bind_unix_socket(server_class, socket_path: str, queue_size: Optional[int] = None):
+    """Create a server on socket_path, replacing a stale socket file"""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = server_class(socket_path, TTSRequestHandler, bind_and_activate=False)
+    if queue_size is not None:
+        server.request_queue_size = queue_size
+    server.server_bind()
+    server.server_activate()
+    os.chmod(socket_path, 0o660)
+    return server
+
+
+def serve_daemon(socket_path: str = DEFAULT_SOCKET_PATH, hot_cache_mb: float = HOT_CACHE_MB) -> None:
+    """Load all voices once and serve synthesis requests on a Unix socket"""
+    loaded = load_voices()
+    enable_hot_cache(hot_cache_mb)
+    enable_adpcm_offload()
+    server = _bind_unix_socket(TTSDaemon, socket_path)
+    print(f"[Piper TTS] Daemon listening on {socket_path} ({loaded} voices loaded)", file=sys.stderr)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        flush_hot_cache_hits()
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def serve_pool(socket_path: str = DEFAULT_SOCKET_PATH, workers: Optional[int] = None,
+               queue_size: int = 64, hot_cache_mb: float = HOT_CACHE_MB) -> None:
+    """
+    Load all voices once, then fork worker processes that share them.
+    
+    Voices are loaded before forking so model memory is shared copy-on-write
+    between workers. Every worker accepts from the same listening socket and
+    handles one synthesis at a time; the listen backlog (queue_size) bounds
+    how many connections may wait for a free worker. Dead workers are
+    replaced until the parent receives SIGTERM or SIGINT. Each worker keeps
+    its own hot tier of hot_cache_mb.
+    """
+    workers = workers or os.cpu_count() or 1
+    loaded = load_voices()
+    enable_hot_cache(hot_cache_mb)
+    server = _bind_unix_socket(TTSWorkerServer, socket_path, queue_size)
+    # All workers poll the same listening socket; a worker that loses the
+    # accept race gets EAGAIN (ignored by socketserver) instead of blocking
+    server.socket.setblocking(False)
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn_worker() -> None:
+        pid = os.fork()
+        if pid == 0:
+            # Leave serve_forever() through SystemExit so the hot tier's hits are flushed
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            try:
+                server.serve_forever()
+            finally:
+                with contextlib.suppress(Exception):
+                    flush_hot_cache_hits()
+                os._exit(0)
+        children[pid] = pid
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn_worker()
+    print(f"[Piper TTS] Pool listening on {socket_path} ({workers} workers, "
+          f"{loaded} voices loaded, queue size {queue_size})", file=sys.stderr)
+
+    try:
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            children.pop(pid, None)
+            if not stopping:
+                print(f"[Piper TTS] Worker {pid} exited with status {status}, restarting",
+                      file=sys.stderr)
+                spawn_worker()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+async def _serve_async(socket_path: str, workers: int, max_queue: int) -> None:
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="piper-async")
+    queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+    order = itertools.count()
+
+    def discard(result) -> None:
+        status, payload = result
+        if not isinstance(payload, (bytes, bytearray, memoryview)):
+            payload.close()
+
+    async def worker() -> None:
+        while True:
+            _, _, deadline, request, future = await queue.get()
+            try:
+                if future.done():
+                    continue  # caller gave up while queued
+                if time.monotonic() >= deadline:
+                    future.set_result((STATUS_ERROR, b"Deadline exceeded"))
+                    continue
+                result = await loop.run_in_executor(executor, handle_request, request, deadline)
+                if future.done():
+                    discard(result)
+                else:
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_result((STATUS_ERROR, str(e).encode()))
+            finally:
+                queue.task_done()
+
+    async def submit(request) -> Tuple[int, Union[bytes, BinaryIO]]:
+        if not isinstance(request, dict) or request.get("op", "speak") != "speak":
+            if isinstance(request, dict) and request.get("op") == "stream":
+                return STATUS_ERROR, b"Streaming is not supported by the async server"
+            try:
+                return await loop.run_in_executor(None, handle_request, request)
+            except Exception as e:
+                return STATUS_ERROR, str(e).encode()
+
+        try:
+            _, _, _, timeout, priority = parse_speak_request(request)
+        except ValueError as e:
+            return STATUS_ERROR, str(e).encode()
+        if queue.qsize() >= max_queue:
+            return STATUS_BUSY, b"Server busy"
+        timeout = timeout or SYNTHESIS_TIMEOUT
+        deadline = time.monotonic() + timeout
+        future = loop.create_future()
+        queue.put_nowait((priority, next(order), deadline, request, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return STATUS_ERROR, b"Deadline exceeded"
+
+    async def respond(writer: asyncio.StreamWriter, status: int, payload) -> None:
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            writer.write(struct.pack(">IB", len(payload) + 1, status))
+            writer.write(payload)
+            await writer.drain()
+            return
+        with payload:
+            size = os.fstat(payload.fileno()).st_size
+            writer.write(struct.pack(">IB", size + 1, status))
+            await writer.drain()
+            await loop.sendfile(writer.transport, payload)
+
+    async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    (size,) = struct.unpack(">I", await reader.readexactly(4))
+                    if size > MAX_FRAME_SIZE:
+                        raise ValueError(f"Frame too large: {size} bytes")
+                    request = json.loads(await reader.readexactly(size))
+                except asyncio.IncompleteReadError:
+                    return
+                except ValueError as e:
+                    # Malformed frame or JSON: report and drop the connection
+                    await respond(writer, STATUS_ERROR, str(e).encode())
+                    return
+                status, payload = await submit(request)
+                await respond(writer, status, payload)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(handle_connection, socket_path)
+    os.chmod(socket_path, 0o660)
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    stopped = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopped.set)
+    try:
+        await stopped.wait()
+    finally:
+        server.close()
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def serve_async(socket_path: str = DEFAULT_SOCKET_PATH, workers: Optional[int] = None,
+                max_queue: int = 64, hot_cache_mb: float = HOT_CACHE_MB) -> None:
+    """
+    Serve requests from one asyncio event loop feeding a priority queue.
+    
+    Connections are accepted and read concurrently; "speak" requests are
+    queued by priority ("interactive" ahead of "batch", FIFO within one)
+    and run by `workers` synthesis threads. When max_queue requests are
+    already waiting, new ones are rejected at once with STATUS_BUSY.
+    Every request has a deadline of its "timeout" seconds (default
+    SYNTHESIS_TIMEOUT) from arrival: it is dropped if still queued then,
+    and piper calls made for it get only the remaining time.
+    """
+    workers = workers or os.cpu_count() or 1
+    loaded = load_voices()
+    enable_hot_cache(hot_cache_mb)
+    enable_adpcm_offload()
+    print(f"[Piper TTS] Async server listening on {socket_path} ({workers} workers, "
+          f"{loaded} voices loaded, max queue {max_queue})", file=sys.stderr)
+    try:
+        asyncio.run(_serve_async(socket_path, workers, max_queue))
+    finally:
+        flush_hot_cache_hits()
+
+
+def request_speech(text: str, language: str, speed: float = 1.0, audio_format: str = "pcm16",
+                   sample_rate: Optional[int] = None, socket_path: str = DEFAULT_SOCKET_PATH,
+                   timeout: float = SYNTHESIS_TIMEOUT, priority: str = "interactive") -> bytes:
+    """Synthesize through a running daemon. Raises RuntimeError on failure."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        request = {"text": text, "language": language, "speed": speed, "format": audio_format,
+                   "sample_rate": sample_rate, "timeout": timeout, "priority": priority}
+        write_frame(sock, json.dumps(request).encode())
+        response = read_frame(sock)
+    if not response:
+        raise RuntimeError("Daemon closed connection")
+    if response[0] != STATUS_OK:
+        raise RuntimeError(response[1:].decode("utf-8", "replace"))
+    return response[1:]
+
+
+def main(argv) -> int:
+    """Command line entry point"""
+    if argv and argv[0].startswith("--"):
+        parser = argparse.ArgumentParser(prog="piperTTS.py", description="Piper TTS server modes")
+        mode = parser.add_mutually_exclusive_group(required=True)
+        mode.add_argument("--daemon", action="store_true",
+                          help="serve requests on a Unix socket from one process")
+        mode.add_argument("--pool", action="store_true",
+                          help="serve requests from pre-forked workers sharing loaded voices")
+        mode.add_argument("--async", dest="async_server", action="store_true",
+                          help="serve requests from an asyncio loop with a priority queue and deadlines")
+        mode.add_argument("--evict", action="store_true",
+                          help="evict least recently used clips down to the cache budget")
+        mode.add_argument("--reindex", action="store_true",
+                          help="rebuild the cache index from the files in CACHE_DIR")
+        mode.add_argument("--stats", action="store_true", help="print cache statistics as JSON")
+        mode.add_argument("--clear", action="store_true", help="delete every cached clip")
+        mode.add_argument("--invalidate", action="store_true",
+                          help="delete the cached clips matching --voice, --language, "
+                               "--older-than and --text-match, in batches")
+        mode.add_argument("--migrate-keys", action="store_true",
+                          help="re-key and deduplicate cached clips after a cache key change")
+        mode.add_argument("--repair-rates", action="store_true",
+                          help="fix the sample rate in headers of clips cached with the wrong rate")
+        mode.add_argument("--stream", nargs="+", metavar=("LANGUAGE", "TEXT"),
+                          help="stream LANGUAGE TEXT [SPEED] to stdout sentence by sentence")
+        mode.add_argument("--batch", action="store_true",
+                          help="read JSON Lines {text, language, speed, format, sample_rate} from stdin "
+                               "and write length-prefixed WAV blobs (empty on failure) to stdout in order")
+        parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Unix socket path")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="pool / async synthesis worker count (default: CPU count)")
+        parser.add_argument("--queue-size", type=int, default=64,
+                            help="max connections waiting for a pool worker, "
+                                 "or max queued requests with --async")
+        parser.add_argument("--hot-cache-mb", type=float, default=HOT_CACHE_MB,
+                            help="in-memory cache per server process, 0 to disable "
+                                 "(default: PIPER_TTS_HOT_CACHE_MB or 64)")
+        parser.add_argument("--max-mb", type=float, default=None,
+                            help="cache size budget for --evict (default: PIPER_TTS_CACHE_MAX_MB)")
+        parser.add_argument("--max-files", type=int, default=None,
+                            help="cache file budget for --evict (default: PIPER_TTS_CACHE_MAX_FILES)")
+        parser.add_argument("--framed", action="store_true",
+                            help="with --stream, emit length-prefixed frames instead of one WAV stream")
+        parser.add_argument("--voice", help="with --invalidate, voice model whose clips to delete")
+        parser.add_argument("--language", help="with --invalidate, language code (and its regional variants)")
+        parser.add_argument("--older-than", type=float, metavar="DAYS",
+                            help="with --invalidate, only clips created more than DAYS ago")
+        parser.add_argument("--text-match", metavar="REGEX",
+                            help="with --invalidate, only clips whose text matches REGEX")
+        parser.add_argument("--batch-size", type=int, default=256,
+                            help="with --invalidate, clips deleted per index transaction")
+        parser.add_argument("--pause", type=float, default=0.0,
+                            help="with --invalidate, seconds to sleep between batches")
+        parser.add_argument("--drop-unknown", action="store_true",
+                            help="with --migrate-keys, delete clips that cannot be re-keyed")
+        parser.add_argument("--cache-only", action="store_true",
+                            help="with --batch, only fill the cache and print one JSON status line per item")
+        args = parser.parse_args(argv)
+
+        if args.daemon:
+            serve_daemon(args.socket, args.hot_cache_mb)
+        elif args.pool:
+            serve_pool(args.socket, args.workers, args.queue_size, args.hot_cache_mb)
+        elif args.async_server:
+            serve_async(args.socket, args.workers, args.queue_size, args.hot_cache_mb)
+        elif args.evict:
+            print(evict_cache(args.max_mb, args.max_files))
+        elif args.reindex:
+            print(rebuild_cache_index())
+        elif args.stats:
+            print(json.dumps(get_cache_stats()))
+        elif args.clear:
+            print(clear_cache())
+        elif args.invalidate:
+            if not (args.voice or args.language or args.older_than is not None or args.text_match):
+                parser.error("--invalidate needs --voice, --language, --older-than or --text-match "
+                             "(use --clear to delete everything)")
+            text_filter = re.compile(args.text_match).search if args.text_match else None
+            older_than = args.older_than * 86400 if args.older_than is not None else None
+            print(invalidate_cache(args.voice, args.language, older_than, text_filter,
+                                   args.batch_size, args.pause))
+        elif args.migrate_keys:
+            print(json.dumps(migrate_cache_keys(args.drop_unknown)))
+        elif args.repair_rates:
+            print(repair_sample_rates())
+        elif args.stream:
+            if len(args.stream) not in (2, 3):
+                parser.error("--stream takes LANGUAGE TEXT [SPEED]")
+            speed = float(args.stream[2]) if len(args.stream) > 2 else 1.0
+
+            def write(chunk: bytes) -> None:
+                sys.stdout.buffer.write(chunk)
+                sys.stdout.buffer.flush()
+
+            if not stream_speech(args.stream[1], args.stream[0], write, speed, args.framed):
+                print("Failed to generate audio", file=sys.stderr)
+                return 1
+        elif args.batch:
+            requests = [json.loads(line) for line in sys.stdin if line.strip()]
+            results = generate_speech_batch(requests)
+            for i, audio in enumerate(results):
+                if args.cache_only:
+                    print(json.dumps({"index": i, "ok": audio is not None}))
+                else:
+                    audio = audio or b""
+                    sys.stdout.buffer.write(struct.pack(">I", len(audio)) + audio)
+            sys.stdout.flush()
+            return 0 if all(results) else 1
+        return 0
+
     # Check if being called from Node.js wrapper or command line
-    if len(sys.argv) < 3:
-        print("Usage: python piperTTS.py <language> <text> [speed]")
+    if len(argv) < 2:
+        print("Usage: python piperTTS.py <language> <text> [speed] [pcm16|ulaw|adpcm] [sample_rate]")
+        print("       python piperTTS.py --daemon|--pool|--async [--socket PATH]")
+        print("       python piperTTS.py --evict [--max-mb MB] [--max-files N]")
+        print("       python piperTTS.py --reindex|--stats|--clear|--migrate-keys|--repair-rates")
+        print("       python piperTTS.py --invalidate [--voice V] [--language L] [--older-than DAYS] "
+              "[--text-match REGEX]")
+        print("       python piperTTS.py --stream <language> <text> [speed] [--framed]")
+        print("       python piperTTS.py --batch [--cache-only] < requests.jsonl")
         print("Example: python piperTTS.py es 'Hola mundo' 1.0")
-        sys.exit(1)
+        return 1
     
-    lang = sys.argv[1]
-    text = sys.argv[2]
-    speed = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    lang = argv[0]
+    text = argv[1]
+    speed = float(argv[2]) if len(argv) > 2 else 1.0
+    audio_format = argv[3] if len(argv) > 3 else "pcm16"
+    sample_rate = int(argv[4]) if len(argv) > 4 else None
     
     # Generate audio
-    audio = generate_speech(text, lang, speed)
+    audio = generate_speech(text, lang, speed, audio_format, sample_rate, open_file=True)
     
     if audio:
         # Output to stdout for Node.js wrapper
-        sys.stdout.buffer.write(audio)
-        sys.stdout.buffer.flush()
-    else:
-        print("Failed to generate audio", file=sys.stderr)
-        sys.exit(1)
+        sys.stdout.flush()
+        send_audio(audio, sys.stdout.fileno())
+        return 0
+
+    print("Failed to generate audio", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -4,8 +4,19 @@
  */
 
 import { z } from "zod";
-import { publicProcedure, router } from "./_core/trpc";
-import { generateSpeech, getCacheStats, clearCache } from "./piperTTSWrapper";
+import { adminProcedure, publicProcedure, router } from "./_core/trpc";
+import {
+  generateSpeech,
+  generateSpeechBatch,
+  getCacheStats,
+  clearCache,
+  invalidateCache,
+} from "./piperTTSWrapper";
+
+// Compact encodings (µ-law, IMA-ADPCM) shrink clips 2-4x for low-bandwidth clients
+const audioFormat = z.enum(["pcm16", "ulaw", "adpcm"]).optional().default("pcm16");
+// Output rate in Hz; omitted means the voice's own rate (16 kHz halves 22.05 kHz clips)
+const sampleRate = z.number().int().min(8000).max(48000).optional();
 
 export const piperTTSRouter = router({
   /**
@@ -17,13 +28,15 @@ export const piperTTSRouter = router({
         text: z.string().min(1).max(500),
         language: z.string().min(2).max(10),
         speed: z.number().min(0.5).max(2.0).optional().default(1.0),
+        format: audioFormat,
+        sampleRate,
       })
     )
     .mutation(async ({ input }) => {
-      const { text, language, speed } = input;
+      const { text, language, speed, format, sampleRate } = input;
 
       // Generate speech using Piper TTS
-      const result = await generateSpeech({ text, language, speed });
+      const result = await generateSpeech({ text, language, speed, format, sampleRate });
 
       if (!result.success || !result.audio) {
         throw new Error(result.error || "Failed to generate pronunciation");
@@ -40,6 +53,43 @@ export const piperTTSRouter = router({
       };
     }),
 
+  /**
+   * Generate pronunciation audio for many phrases at once (e.g. a lesson page)
+   */
+  generatePronunciationBatch: publicProcedure
+    .input(
+      z.object({
+        items: z
+          .array(
+            z.object({
+              text: z.string().min(1).max(500),
+              language: z.string().min(2).max(10),
+              speed: z.number().min(0.5).max(2.0).optional().default(1.0),
+              format: audioFormat,
+              sampleRate,
+            })
+          )
+          .min(1)
+          .max(50),
+      })
+    )
+    .mutation(async ({ input }) => {
+      const results = await generateSpeechBatch(input.items);
+
+      return {
+        results: results.map((result) =>
+          result.success && result.audio
+            ? {
+                success: true,
+                audio: result.audio.toString("base64"),
+                mimeType: "audio/wav",
+                size: result.audio.length,
+              }
+            : { success: false, error: result.error || "Failed to generate pronunciation" }
+        ),
+      };
+    }),
+
   /**
    * Get cache statistics
    */
@@ -47,6 +97,31 @@ export const piperTTSRouter = router({
     return await getCacheStats();
   }),
 
+  /**
+   * Delete cached clips by voice model, language, age and/or text (admins only:
+   * textMatch is a regex run against every cached text)
+   */
+  invalidateCache: adminProcedure
+    .input(
+      z
+        .object({
+          voiceModel: z.string().min(1).max(100).optional(),
+          language: z.string().min(2).max(10).optional(),
+          olderThanDays: z.number().min(0).optional(),
+          textMatch: z.string().min(1).max(200).optional(),
+        })
+        .refine((filter) => Object.values(filter).some((value) => value !== undefined), {
+          message: "At least one filter is required (use clearCache to delete everything)",
+        })
+    )
+    .mutation(async ({ input }) => {
+      const count = await invalidateCache(input);
+      return {
+        success: true,
+        filesDeleted: count,
+      };
+    }),
+
   /**
    * Clear TTS cache (admin only in production)
    */
@@ -4,6 +4,8 @@
  */
 
 import { spawn } from 'child_process';
+import fs from 'fs';
+import net from 'net';
 import path from 'path';
 import { fileURLToPath } from 'url';
 import { dirname } from 'path';
@@ -11,11 +13,24 @@ import { dirname } from 'path';
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = dirname(__filename);
 const PIPER_SCRIPT = path.join(__dirname, 'piperTTS.sh');
+// Socket of a long-running `piperTTS.py --daemon` (or --pool / --async), used when present
+const PIPER_SOCKET = process.env.PIPER_TTS_SOCKET || '/tmp/piper-tts.sock';
+const STATUS_OK = 0;
+
+/** WAV encodings: 16-bit PCM, 8-bit µ-law (~2x smaller), IMA-ADPCM (~4x smaller) */
+export type TTSAudioFormat = 'pcm16' | 'ulaw' | 'adpcm';
 
 export interface TTSOptions {
   text: string;
   language: string;
   speed?: number;
+  format?: TTSAudioFormat;
+  /** Output sample rate in Hz (e.g. 16000); defaults to the voice's own rate */
+  sampleRate?: number;
+  /** Queue priority on the async server: user-facing requests run ahead of batch work */
+  priority?: 'interactive' | 'batch';
+  /** Deadline for the whole request in milliseconds (default 10s) */
+  timeoutMs?: number;
 }
 
 export interface TTSResult {
@@ -24,16 +39,113 @@ export interface TTSResult {
   error?: string;
 }
 
+/** Error reported by the daemon itself (as opposed to a connection failure) */
+class TTSDaemonError extends Error {}
+
+/**
+ * Send one framed request to the Piper TTS daemon.
+ * Frames are a 4-byte big-endian length followed by the payload; responses
+ * carry a leading status byte.
+ */
+function requestFromDaemon(request: object, timeoutMs = 10000): Promise<Buffer> {
+  return new Promise((resolve, reject) => {
+    const socket = net.createConnection(PIPER_SOCKET);
+    let received = Buffer.alloc(0);
+
+    socket.setTimeout(timeoutMs, () => {
+      socket.destroy(new Error('TTS daemon timeout'));
+    });
+
+    socket.on('connect', () => {
+      const payload = Buffer.from(JSON.stringify(request), 'utf-8');
+      const header = Buffer.alloc(4);
+      header.writeUInt32BE(payload.length);
+      socket.write(Buffer.concat([header, payload]));
+    });
+
+    socket.on('data', (data: Buffer) => {
+      received = Buffer.concat([received, data]);
+      if (received.length < 4) return;
+      const size = received.readUInt32BE(0);
+      if (received.length < 4 + size) return;
+
+      socket.end();
+      const frame = received.subarray(4, 4 + size);
+      if (frame.length > 0 && frame[0] === STATUS_OK) {
+        resolve(frame.subarray(1));
+      } else {
+        reject(new TTSDaemonError(frame.subarray(1).toString('utf-8') || 'TTS daemon error'));
+      }
+    });
+
+    socket.on('error', reject);
+    socket.on('close', () => reject(new Error('TTS daemon closed connection')));
+  });
+}
+
+function daemonAvailable(): boolean {
+  return fs.existsSync(PIPER_SOCKET);
+}
+
+/** True when the daemon is not running (stale or missing socket), so spawning is the only option */
+function isDaemonDown(err: unknown): boolean {
+  const code = (err as NodeJS.ErrnoException)?.code;
+  return code === 'ECONNREFUSED' || code === 'ENOENT';
+}
+
 /**
  * Generate speech using Piper TTS
  * @param options TTS generation options
  * @returns Promise with audio buffer or error
  */
 export async function generateSpeech(options: TTSOptions): Promise<TTSResult> {
-  const { text, language, speed = 1.0 } = options;
+  const {
+    text,
+    language,
+    speed = 1.0,
+    format = 'pcm16',
+    sampleRate,
+    priority = 'interactive',
+    timeoutMs = 10000,
+  } = options;
+  const startedAt = Date.now();
+
+  if (daemonAvailable()) {
+    try {
+      // The daemon enforces the same deadline and rejects at once when its
+      // queue is full, rather than letting requests pile up
+      const audio = await requestFromDaemon(
+        {
+          op: 'speak',
+          text,
+          language,
+          speed,
+          format,
+          sample_rate: sampleRate,
+          priority,
+          timeout: timeoutMs / 1000,
+        },
+        timeoutMs
+      );
+      return { success: true, audio };
+    } catch (err) {
+      // Only spawn when the daemon is down: after a timeout or a busy/overloaded
+      // daemon, another process would break the deadline and add to the load
+      if (!isDaemonDown(err)) {
+        return { success: false, error: err instanceof Error ? err.message : String(err) };
+      }
+      console.error('[Piper TTS Wrapper] Daemon not running, falling back to spawn:', err);
+    }
+  }
+
+  const remainingMs = timeoutMs - (Date.now() - startedAt);
+  if (remainingMs <= 0) {
+    return { success: false, error: 'TTS generation timeout' };
+  }
 
   return new Promise((resolve) => {
-    const args = [language, text, speed.toString()];
+    const args = [language, text, speed.toString(), format];
+    if (sampleRate) args.push(sampleRate.toString());
     console.log('[Piper TTS Wrapper] Executing:', PIPER_SCRIPT, 'with args:', args);
     const python = spawn(PIPER_SCRIPT, args, {
       cwd: path.dirname(PIPER_SCRIPT),
@@ -72,14 +184,90 @@ export async function generateSpeech(options: TTSOptions): Promise<TTSResult> {
       });
     });
 
-    // Timeout after 10 seconds
+    // Give up at the request deadline
     setTimeout(() => {
       python.kill();
       resolve({
         success: false,
         error: 'TTS generation timeout',
       });
-    }, 10000);
+    }, remainingMs);
+  });
+}
+
+/**
+ * Generate speech for many phrases with one Python process.
+ * Voices are loaded once per batch; results come back in request order.
+ */
+export async function generateSpeechBatch(items: TTSOptions[]): Promise<TTSResult[]> {
+  return new Promise((resolve) => {
+    const python = spawn(PIPER_SCRIPT, ['--batch'], {
+      cwd: path.dirname(PIPER_SCRIPT),
+    });
+
+    const chunks: Buffer[] = [];
+    const errorChunks: Buffer[] = [];
+    let settled = false;
+
+    const fail = (error: string) => {
+      if (settled) return;
+      settled = true;
+      resolve(items.map(() => ({ success: false, error })));
+    };
+
+    python.stdout.on('data', (data: Buffer) => {
+      chunks.push(data);
+    });
+
+    python.stderr.on('data', (data: Buffer) => {
+      errorChunks.push(data);
+    });
+
+    python.on('close', () => {
+      if (settled) return;
+      settled = true;
+      clearTimeout(timer);
+
+      // Output is one length-prefixed WAV blob per item; empty means failure
+      const output = Buffer.concat(chunks);
+      const error = Buffer.concat(errorChunks).toString('utf-8');
+      const results: TTSResult[] = [];
+      let offset = 0;
+      for (let i = 0; i < items.length; i++) {
+        if (offset + 4 > output.length) {
+          results.push({ success: false, error: error || 'Missing batch result' });
+          continue;
+        }
+        const size = output.readUInt32BE(offset);
+        const audio = output.subarray(offset + 4, offset + 4 + size);
+        offset += 4 + size;
+        results.push(
+          size > 0
+            ? { success: true, audio }
+            : { success: false, error: 'Failed to generate audio' }
+        );
+      }
+      resolve(results);
+    });
+
+    python.on('error', (err) => {
+      console.error('[Piper TTS Wrapper] Spawn error:', err);
+      fail(err.message);
+    });
+
+    // Allow 10 seconds per item, as for single requests
+    const timer = setTimeout(() => {
+      python.kill();
+      fail('TTS batch generation timeout');
+    }, 10000 * Math.max(1, items.length));
+
+    python.stdin.end(
+      items
+        .map(({ text, language, speed = 1.0, format = 'pcm16', sampleRate }) =>
+          JSON.stringify({ text, language, speed, format, sample_rate: sampleRate })
+        )
+        .join('\n') + '\n'
+    );
   });
 }
 
@@ -87,17 +275,18 @@ export async function generateSpeech(options: TTSOptions): Promise<TTSResult> {
  * Get cache statistics from Python module
  */
 export async function getCacheStats(): Promise<any> {
+  if (daemonAvailable()) {
+    try {
+      return JSON.parse((await requestFromDaemon({ op: 'stats' })).toString('utf-8'));
+    } catch (err) {
+      console.error('[Piper TTS Wrapper] Daemon stats error, falling back to spawn:', err);
+    }
+  }
+
   return new Promise((resolve) => {
-    const python = spawn(PIPER_SCRIPT, [
-      '-c',
-      `
-import sys
-sys.path.insert(0, '${path.dirname(PIPER_SCRIPT)}')
-from piperTTS import get_cache_stats
-import json
-print(json.dumps(get_cache_stats()))
-      `.trim(),
-    ]);
+    const python = spawn(PIPER_SCRIPT, ['--stats'], {
+      cwd: path.dirname(PIPER_SCRIPT),
+    });
 
     let output = '';
     python.stdout.on('data', (data) => {
@@ -119,15 +308,9 @@ print(json.dumps(get_cache_stats()))
  */
 export async function clearCache(): Promise<number> {
   return new Promise((resolve) => {
-    const python = spawn(PIPER_SCRIPT, [
-      '-c',
-      `
-import sys
-sys.path.insert(0, '${path.dirname(PIPER_SCRIPT)}')
-from piperTTS import clear_cache
-print(clear_cache())
-      `.trim(),
-    ]);
+    const python = spawn(PIPER_SCRIPT, ['--clear'], {
+      cwd: path.dirname(PIPER_SCRIPT),
+    });
 
     let output = '';
     python.stdout.on('data', (data) => {
@@ -139,3 +322,70 @@ print(clear_cache())
     });
   });
 }
+
+export interface TTSInvalidationFilter {
+  /** Voice model whose clips to delete, e.g. after upgrading it */
+  voiceModel?: string;
+  /** Language code; also matches its regional variants ('de' matches 'de-DE') */
+  language?: string;
+  /** Only clips created more than this many days ago */
+  olderThanDays?: number;
+  /** Only clips whose text matches this regular expression (Python syntax) */
+  textMatch?: string;
+}
+
+/**
+ * Delete the cached clips matching every given filter, in small batches.
+ * Goes through the daemon when it runs, so its in-memory tier drops them at once.
+ */
+export async function invalidateCache(filter: TTSInvalidationFilter): Promise<number> {
+  const { voiceModel, language, olderThanDays, textMatch } = filter;
+
+  if (daemonAvailable()) {
+    try {
+      const response = await requestFromDaemon(
+        {
+          op: 'invalidate',
+          voice_model: voiceModel,
+          language,
+          older_than: olderThanDays === undefined ? undefined : olderThanDays * 86400,
+          text_match: textMatch,
+        },
+        120000
+      );
+      return JSON.parse(response.toString('utf-8')).deleted;
+    } catch (err) {
+      if (!isDaemonDown(err)) throw err;
+      console.error('[Piper TTS Wrapper] Daemon not running, invalidating via spawn:', err);
+    }
+  }
+
+  const args = ['--invalidate'];
+  if (voiceModel) args.push('--voice', voiceModel);
+  if (language) args.push('--language', language);
+  if (olderThanDays !== undefined) args.push('--older-than', olderThanDays.toString());
+  if (textMatch) args.push('--text-match', textMatch);
+
+  return new Promise((resolve, reject) => {
+    const python = spawn(PIPER_SCRIPT, args, {
+      cwd: path.dirname(PIPER_SCRIPT),
+    });
+
+    let output = '';
+    let error = '';
+    python.stdout.on('data', (data) => {
+      output += data.toString();
+    });
+    python.stderr.on('data', (data) => {
+      error += data.toString();
+    });
+
+    python.on('close', (code) => {
+      if (code === 0) {
+        resolve(parseInt(output.trim()) || 0);
+      } else {
+        reject(new Error(error || `Process exited with code ${code}`));
+      }
+    });
+  });
+}
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Regression tests for piperTTS.py. Runs against scripts/fake_piper.py and
+throwaway cache/voice directories:
+
+    python -m unittest server/test_piperTTS.py
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import struct
+import hashlib
+import shutil
+import socket
+import subprocess
+import tempfile
+import importlib
+import importlib.util
+import unittest
+import unittest.mock
+from concurrent.futures import ThreadPoolExecutor
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_PIPER = os.path.join(os.path.dirname(SERVER_DIR), 'scripts', 'fake_piper.py')
+
+tts = None
+_tmp_dir = None
+
+
+def setUpModule():
+    global tts, _tmp_dir
+    _tmp_dir = tempfile.mkdtemp(prefix='piper-tts-test-')
+    os.environ['PIPER_TTS_CACHE_DIR'] = os.path.join(_tmp_dir, 'cache')
+    os.environ['PIPER_TTS_VOICES_DIR'] = os.path.join(_tmp_dir, 'voices')
+    os.environ['PIPER_TTS_PIPER_BIN'] = FAKE_PIPER
+    os.makedirs(os.environ['PIPER_TTS_CACHE_DIR'])
+    os.makedirs(os.environ['PIPER_TTS_VOICES_DIR'])
+    sys.path.insert(0, SERVER_DIR)
+    tts = importlib.import_module('piperTTS')
+
+    # Tests must not pick up a real in-process voice
+    tts.PiperVoice = None
+    for voice_model in set(tts.VOICE_MODELS.values()):
+        open(os.path.join(os.environ['PIPER_TTS_VOICES_DIR'], f'{voice_model}.onnx'), 'a').close()
+
+
+def tearDownModule():
+    shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+
+def wav_files_on_disk():
+    return [entry.path for entry in tts.iter_cache_files()]
+
+
+class EvictionTest(unittest.TestCase):
+    def setUp(self):
+        tts.clear_cache()
+
+    def test_evict_deletes_flat_clips_adopted_by_reindex(self):
+        clip = tts.create_wav_header(b'\0' * 64) + b'\0' * 64
+        for i in range(5):
+            key = tts.get_cache_key(f'plano {i}', 'es', 1.0)
+            (tts.CACHE_DIR / f'{key}.wav').write_bytes(clip)
+        self.assertEqual(tts.rebuild_cache_index(), 5)
+
+        evicted = tts.evict_cache(max_files=2)
+
+        self.assertEqual(evicted, 4)
+        self.assertEqual(len(wav_files_on_disk()), 1)
+        self.assertEqual(int(tts.get_cache_stats()['file_count']), 1)
+
+
+class MigrateCacheKeysTest(unittest.TestCase):
+    def setUp(self):
+        tts.clear_cache()
+
+    def cache_under_old_key(self, text, language):
+        """A clip indexed under a key from before keys used the resolved voice"""
+        old_key = hashlib.md5(f'{language}|{text}|1.0'.encode()).hexdigest()
+        tts.save_to_cache(old_key, tts.create_wav_header(b'\0' * 64) + b'\0' * 64,
+                          language, '', text, 1.0)
+        return old_key
+
+    def test_rekeys_clip_to_canonical_key(self):
+        old_key = self.cache_under_old_key('Hola', 'es-ES')
+
+        self.assertEqual(tts.migrate_cache_keys()['rekeyed'], 1)
+
+        new_key = tts.get_cache_key('Hola', 'es', 1.0)
+        self.assertTrue(tts.is_cached(new_key))
+        self.assertFalse(tts.is_cached(old_key))
+        self.assertEqual(int(tts.get_cache_stats()['file_count']), 1)
+
+    def test_replaces_index_row_whose_file_is_missing(self):
+        self.cache_under_old_key('Hola', 'es-ES')
+        new_key = tts.get_cache_key('Hola', 'es', 1.0)
+        tts.save_to_cache(new_key, tts.create_wav_header(b''), 'es')
+        os.unlink(tts.get_cache_path(new_key))
+
+        self.assertEqual(tts.migrate_cache_keys()['rekeyed'], 1)
+
+        self.assertTrue(tts.is_cached(new_key))
+        self.assertEqual(int(tts.get_cache_stats()['file_count']), 1)
+
+    def test_deletes_duplicate_of_cached_clip(self):
+        old_key = self.cache_under_old_key('Hola', 'es-ES')
+        tts.generate_speech('Hola', 'es')
+
+        self.assertEqual(tts.migrate_cache_keys()['deduplicated'], 1)
+
+        self.assertFalse(tts.is_cached(old_key))
+        self.assertEqual(int(tts.get_cache_stats()['file_count']), 1)
+
+
+def sine_pcm(frequency, seconds, sample_rate=22050):
+    samples = int(seconds * sample_rate)
+    return struct.pack(f'<{samples}h', *(int(8000 * math.sin(2 * math.pi * frequency * i / sample_rate))
+                                         for i in range(samples)))
+
+
+def decode_ima_adpcm(data, samples_per_block, block_align=512):
+    """Reference IMA-ADPCM decoder for the encoder's output"""
+    samples = []
+    for start in range(0, len(data), block_align):
+        block = data[start:start + block_align]
+        predictor, index = struct.unpack_from('<hB', block)
+        samples.append(predictor)
+        for byte in block[4:]:
+            for code in (byte & 0x0F, byte >> 4):
+                step = tts._ADPCM_STEPS[index]
+                delta = step >> 3
+                if code & 4:
+                    delta += step
+                if code & 2:
+                    delta += step >> 1
+                if code & 1:
+                    delta += step >> 2
+                predictor = predictor - delta if code & 8 else predictor + delta
+                predictor = max(-32768, min(32767, predictor))
+                index = max(0, min(88, index + tts._ADPCM_INDEX_ADJUST[code]))
+                samples.append(predictor)
+    return samples
+
+
+class EncodingTest(unittest.TestCase):
+    def test_ulaw_codes(self):
+        pcm = struct.pack('<5h', 0, 32767, -32768, 1000, -1000)
+        expected = bytes([0xFF, 0x80, 0x00, 0xCE, 0x4E])
+        self.assertEqual(tts.encode_ulaw(pcm), expected)
+
+        numpy, tts.np = tts.np, None
+        try:
+            self.assertEqual(tts.encode_ulaw(pcm), expected)
+        finally:
+            tts.np = numpy
+
+    def test_ima_adpcm_round_trip(self):
+        pcm = sine_pcm(440, 0.5)
+        data, samples_per_block = tts.encode_ima_adpcm(pcm)
+
+        self.assertEqual(samples_per_block, (tts.ADPCM_BLOCK_ALIGN - 4) * 2 + 1)
+        self.assertEqual(len(data) % tts.ADPCM_BLOCK_ALIGN, 0)
+        original = struct.unpack(f'<{len(pcm) // 2}h', pcm)
+        decoded = decode_ima_adpcm(data, samples_per_block)[:len(original)]
+        self.assertEqual(len(decoded), len(original))
+        # Once the step size has adapted (a few ms), tracking stays close
+        errors = [abs(a - b) for a, b in zip(original, decoded)]
+        self.assertLess(max(errors[200:]), 300)
+
+    def test_adpcm_wav_header(self):
+        wav_data = tts.encode_wav(sine_pcm(440, 0.1), 'adpcm', 16000)
+        format_tag, channels, sample_rate, _, block_align, bits = struct.unpack_from('<HHIIHH', wav_data, 20)
+        self.assertEqual((format_tag, channels, sample_rate, block_align, bits),
+                         (0x11, 1, 16000, tts.ADPCM_BLOCK_ALIGN, 4))
+
+
+def dominant_frequency(pcm, sample_rate):
+    samples = tts.np.frombuffer(pcm, dtype='<i2').astype(float)
+    spectrum = abs(tts.np.fft.rfft(samples))
+    return tts.np.argmax(spectrum) * sample_rate / len(samples)
+
+
+@unittest.skipIf(importlib.util.find_spec('numpy') is None, 'requires numpy')
+class AudioProcessingTest(unittest.TestCase):
+    def test_time_stretch_output_length(self):
+        pcm = sine_pcm(220, 1.0)
+        for speed in (0.5, 0.75, 1.25, 2.0):
+            with self.subTest(speed=speed):
+                stretched = tts.time_stretch(pcm, speed)
+                self.assertEqual(len(stretched), 2 * round(len(pcm) // 2 / speed))
+
+    def test_time_stretch_keeps_pitch(self):
+        stretched = tts.time_stretch(sine_pcm(220, 1.0), 1.5)
+        self.assertAlmostEqual(dominant_frequency(stretched, 22050), 220, delta=10)
+
+    def test_resample_length_and_pitch(self):
+        pcm = sine_pcm(440, 1.0)
+        for rate in (8000, 16000, 44100):
+            with self.subTest(rate=rate):
+                resampled = tts.resample(pcm, 22050, rate)
+                self.assertEqual(len(resampled), 2 * round(len(pcm) // 2 * rate / 22050))
+                self.assertAlmostEqual(dominant_frequency(resampled, rate), 440, delta=2)
+
+    def test_resample_filters_content_above_new_nyquist(self):
+        resampled = tts.resample(sine_pcm(6000, 1.0), 22050, 8000)
+        samples = struct.unpack(f'<{len(resampled) // 2}h', resampled)
+        # Away from the edges, where the filter kernel is cut off
+        self.assertLess(max(abs(sample) for sample in samples[50:-50]), 80)
+
+
+class FillLockTest(unittest.TestCase):
+    def setUp(self):
+        tts.clear_cache()
+
+    def test_requests_served_after_waiting_count_as_hits(self):
+        before = tts.get_cache_stats()
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            clips = list(executor.map(lambda _: tts.generate_speech('Una sola vez.', 'es'), range(10)))
+        after = tts.get_cache_stats()
+
+        self.assertEqual(len(set(clips)), 1)
+        self.assertEqual(after['hits'] - before['hits'], 9)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+
+
+def start_server(mode, *args):
+    """piperTTS.py server subprocess on a fresh socket; returns (process, socket path)"""
+    socket_path = os.path.join(_tmp_dir, f'tts{mode}.sock')
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(SERVER_DIR, 'piperTTS.py'), mode, '--socket', socket_path, *args],
+        env=os.environ.copy(), stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.05)
+    return server, socket_path
+
+
+class PoolShutdownTest(unittest.TestCase):
+    def setUp(self):
+        tts.clear_cache()
+
+    def test_sigterm_flushes_hot_tier_hits(self):
+        before = tts.get_cache_stats()['hits']
+        server, socket_path = start_server('--pool', '--workers', '1')
+        try:
+            for _ in range(4):
+                tts.request_speech('Caliente.', 'es', socket_path=socket_path)
+        finally:
+            server.terminate()
+            server.wait(10)
+
+        # The three repeats are served from the worker's hot tier, counted only on flush
+        self.assertEqual(tts.get_cache_stats()['hits'] - before, 3)
+
+
+class SegmentCacheTest(unittest.TestCase):
+    def setUp(self):
+        tts.clear_cache()
+
+    def test_missing_sentences_share_one_piper_run(self):
+        with unittest.mock.patch.object(tts.subprocess, 'run', wraps=subprocess.run) as run:
+            tts.generate_speech('Uno. Dos. Tres.', 'es')
+            self.assertEqual(run.call_count, 1)
+
+            # Only the new sentence is synthesized
+            tts.generate_speech('Dos. Tres. Cuatro.', 'es')
+            self.assertEqual(run.call_count, 2)
+
+        # Two texts plus four sentences
+        self.assertEqual(int(tts.get_cache_stats()['file_count']), 6)
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        tts.clear_cache()
+
+    def stream(self, text):
+        chunks = []
+        self.assertTrue(tts.stream_speech(text, 'es', chunks.append))
+        return b''.join(chunks)[tts.WAV_HEADER_SIZE:]
+
+    def test_streamed_clip_matches_single_request(self):
+        text = 'Primera frase. Segunda frase. Tercera frase.'
+        streamed = self.stream(text)
+        self.assertEqual(tts.generate_speech(text, 'es')[tts.WAV_HEADER_SIZE:], streamed)
+
+        tts.clear_cache()
+        spoken = tts.generate_speech(text, 'es')
+        tts.clear_cache()
+        self.assertEqual(self.stream(text), spoken[tts.WAV_HEADER_SIZE:])
+
+    def test_concurrent_streams_synthesize_once(self):
+        with unittest.mock.patch.object(tts.subprocess, 'Popen', wraps=subprocess.Popen) as popen:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                clips = list(executor.map(lambda _: self.stream('Solo una vez.'), range(4)))
+        self.assertEqual(len(set(clips)), 1)
+        self.assertEqual(popen.call_count, 1)
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        tts.clear_cache()
+
+    def test_multi_sentence_batch_item_matches_single_request(self):
+        text = '¡Hola! ¿Cómo estás?'
+        single = tts.generate_speech(text, 'es')
+        tts.clear_cache()
+
+        (batched,) = tts.generate_speech_batch([{'text': text, 'language': 'es'}])
+
+        self.assertEqual(batched, single)
+        # The whole clip plus one cached segment per sentence
+        self.assertEqual(int(tts.get_cache_stats()['file_count']), 3)
+
+
+INVALID_FIELDS = [
+    {'speed': None},
+    {'speed': 'fast'},
+    {'speed': 0.02},
+    {'speed': 5},
+    {'timeout': 'soon'},
+    {'timeout': -1},
+    {'priority': ['interactive']},
+    {'priority': 'urgent'},
+    {'sample_rate': '16000'},
+]
+
+INVALID_INVALIDATE_FIELDS = [
+    {},
+    {'older_than': '7'},
+    {'older_than': -1},
+    {'older_than': float('inf')},
+    {'voice_model': 5},
+    {'language': ['es']},
+    {'text_match': 3},
+    {'text_match': '('},
+]
+
+
+def invalid_requests():
+    """Every invalid speak and invalidate request, paired with its fields"""
+    for fields in INVALID_FIELDS:
+        yield fields, {'text': 'Hola', 'language': 'es', **fields}
+    for fields in INVALID_INVALIDATE_FIELDS:
+        yield fields, {'op': 'invalidate', **fields}
+
+
+class RequestValidationTest(unittest.TestCase):
+    def test_invalid_fields_get_an_error_status(self):
+        for fields, request in invalid_requests():
+            with self.subTest(request=request):
+                status, payload = tts.handle_request(request)
+                self.assertEqual(status, tts.STATUS_ERROR)
+                self.assertTrue(payload)
+
+    def test_speed_outside_supported_range_fails_cleanly(self):
+        derive_speeds = tts.DERIVE_SPEEDS
+        try:
+            for tts.DERIVE_SPEEDS in (False, True):
+                with self.subTest(derive_speeds=tts.DERIVE_SPEEDS):
+                    self.assertIsNone(tts.generate_speech('Hola', 'es', 0.02))
+                    self.assertEqual(tts.generate_speech_batch([{'text': 'Hola', 'language': 'es', 'speed': 0.02}]),
+                                     [None])
+        finally:
+            tts.DERIVE_SPEEDS = derive_speeds
+
+    def test_servers_reply_with_an_error_frame(self):
+        for mode in ('--daemon', '--async'):
+            with self.subTest(mode=mode):
+                server, socket_path = start_server(mode, '--workers', '1')
+                try:
+                    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                        sock.settimeout(10)
+                        sock.connect(socket_path)
+                        for fields, request in invalid_requests():
+                            tts.write_frame(sock, json.dumps(request).encode())
+                            response = tts.read_frame(sock)
+                            self.assertTrue(response, f'no response for {fields}')
+                            self.assertEqual(response[0], tts.STATUS_ERROR)
+                finally:
+                    server.terminate()
+                    server.wait(10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Tests for the schema.ts parser shared by the migration scripts:
+
+    python -m unittest test_drizzle_schema.py
+"""
+
+import io
+import os
+import re
+import tempfile
+import importlib.util
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+import drizzle_schema
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_PATH = os.path.join(ROOT, 'drizzle', 'schema.ts')
+
+
+def load_script(file_name):
+    """Import one of the hyphen-named migration scripts"""
+    spec = importlib.util.spec_from_file_location(file_name[:-3].replace('-', '_'),
+                                                  os.path.join(ROOT, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+generate_migration = load_script('generate-migration.py')
+SNAPSHOT = generate_migration.SNAPSHOT_PATH
+
+# Constructs the table regex used before the parser could not read
+SCHEMA = '''
+import { int, bigint, mysqlTable, mysqlEnum, varchar, text, json, timestamp, decimal, index } from "drizzle-orm/mysql-core";
+
+export const users = mysqlTable("users", {
+  id: int("id").autoincrement().primaryKey(),
+  openId: varchar("openId", { length: 64 }).notNull().unique(),
+  // Named columns: the database name is the builder's first argument
+  displayName: varchar("display_name", { length: 255 }),
+  legacyRef: int("legacyRefId"),
+  settingsJson: json("settingsJson").$type<{ theme: { mode: "dark" | "light" }; fontSize: number }>(),
+  createdAt: timestamp("createdAt").defaultNow().notNull(),
+});
+
+export const lessonProgress = mysqlTable(
+  "lesson_progress",
+  {
+    userId: int("userId")
+      .notNull()
+      .references(() => users.id, { onDelete: "cascade" }),
+    lessonStatus: mysqlEnum("lessonStatus", ["notStarted", "inProgress", "done"])
+      .default("notStarted")
+      .notNull(),
+    /* braces in comments { and strings do not end the table */
+    notesText: text("notesText").default("}"),
+    scoreValue: decimal("scoreValue", { precision: 5, scale: 2 }),
+    externalId: bigint("externalId", { mode: "number" }),
+  },
+  (table) => ({
+    userIdx: index("lesson_progress_user_idx").on(table.userId, table.lessonStatus),
+  })
+);
+'''
+
+RENAMES = {
+    'users': [
+        ('openId', 'open_id'),
+        ('legacyRefId', 'legacy_ref_id'),
+        ('settingsJson', 'settings_json'),
+        ('createdAt', 'created_at'),
+    ],
+    'lesson_progress': [
+        ('userId', 'user_id'),
+        ('lessonStatus', 'lesson_status'),
+        ('notesText', 'notes_text'),
+        ('scoreValue', 'score_value'),
+        ('externalId', 'external_id'),
+    ],
+}
+
+
+def regex_renames(content):
+    """Renames found by the table regex the parser replaced, for comparison"""
+    found = {}
+    table_pattern = r'export const \w+ = mysqlTable\("(\w+)",\s*\{([^}]+(?:\{[^}]*\}[^}]*)*)\}'
+    column_pattern = r'(\w+):\s*(?:int|varchar|text|timestamp|boolean|decimal|mysqlEnum|json)\('
+    for match in re.finditer(table_pattern, content, re.DOTALL):
+        for col_match in re.finditer(column_pattern, match.group(2)):
+            column = col_match.group(1)
+            snake = drizzle_schema.camel_to_snake(column)
+            if column not in ['on', 'set', 'where', 'from', 'to'] and column != snake:
+                found.setdefault(match.group(1), set()).add((column, snake))
+    return found
+
+
+class ParserTest(unittest.TestCase):
+    def setUp(self):
+        self.tables = {table.name: table for table in drizzle_schema.parse_schema(SCHEMA)}
+
+    def test_tables_and_columns(self):
+        self.assertEqual(list(self.tables), ['users', 'lesson_progress'])
+        users = self.tables['users']
+        self.assertEqual(users.var_name, 'users')
+        self.assertEqual([column.name for column in users.columns],
+                         ['id', 'openId', 'displayName', 'legacyRef', 'settingsJson', 'createdAt'])
+        self.assertEqual(users.column('displayName').db_name, 'display_name')
+        self.assertEqual(users.column('openId').options, {'length': 64})
+        self.assertTrue(users.column('createdAt').not_null)
+        self.assertIn('$type', users.column('settingsJson').modifiers)
+
+    def test_multi_line_definitions(self):
+        progress = self.tables['lesson_progress']
+        self.assertEqual(progress.column('userId').line, 17)
+        self.assertEqual(progress.column('userId').modifiers['references'],
+                         '() => users.id, { onDelete: "cascade" }')
+        self.assertEqual(progress.column('lessonStatus').enum_values, ['notStarted', 'inProgress', 'done'])
+        self.assertEqual(progress.column('notesText').modifiers['default'], '"}"')
+        self.assertEqual(progress.column('scoreValue').options, {'precision': 5, 'scale': 2})
+        self.assertEqual([(index.name, index.columns) for index in progress.indexes],
+                         [('lesson_progress_user_idx', ['userId', 'lessonStatus'])])
+
+    def test_pinned_renames(self):
+        tables = drizzle_schema.parse_schema(SCHEMA)
+        self.assertEqual(generate_migration.extract_columns(tables), RENAMES)
+
+    def test_finds_every_rename_the_regex_found(self):
+        with open(SCHEMA_PATH) as f:
+            content = f.read()
+        parsed = generate_migration.extract_columns(drizzle_schema.parse_schema(content))
+        for table_name, renames in regex_renames(content).items():
+            with self.subTest(table=table_name):
+                self.assertLessEqual(renames, set(parsed.get(table_name, [])))
+
+    def test_unbalanced_source_is_an_error(self):
+        with self.assertRaises(SyntaxError):
+            drizzle_schema.parse_schema('export const t = mysqlTable("t", { id: int("id"), ')
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.snapshot_path = os.path.join(self.dir.name, 'snapshot.json')
+        self.tables = drizzle_schema.parse_schema(SCHEMA)
+        self.settings = {'dialect': 'postgres', 'per_table': False, 'timing': False}
+
+    def test_round_trip(self):
+        drizzle_schema.save_snapshot(self.snapshot_path, self.tables, RENAMES, {}, self.settings)
+        snapshot = drizzle_schema.load_snapshot(self.snapshot_path)
+        self.assertEqual(snapshot['settings'], self.settings)
+        self.assertEqual(snapshot['tables']['users']['renames'], [list(rename) for rename in RENAMES['users']])
+        self.assertEqual(drizzle_schema.schema_delta(self.tables, RENAMES, snapshot['tables']), {})
+
+    def test_table_outside_the_snapshot_is_new(self):
+        covered = [table for table in self.tables if table.name == 'users']
+        drizzle_schema.save_snapshot(self.snapshot_path, covered, RENAMES, {}, self.settings)
+        snapshot = drizzle_schema.load_snapshot(self.snapshot_path)
+        self.assertEqual(list(snapshot['tables']), ['users'])
+        self.assertEqual(drizzle_schema.schema_delta(self.tables, RENAMES, snapshot['tables']),
+                         {'lesson_progress': RENAMES['lesson_progress']})
+
+    def test_older_snapshot_has_no_settings(self):
+        with open(self.snapshot_path, 'w') as f:
+            f.write('{"schema_version": 1, "tables": {"users": {"hash": "", "renames": []}}}')
+        self.assertEqual(drizzle_schema.load_snapshot(self.snapshot_path), {'settings': {}, 'tables': {}})
+
+
+class MigrationScriptTest(unittest.TestCase):
+    """generate-migration.py end to end, in a scratch directory"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        os.mkdir(os.path.join(self.dir.name, 'drizzle'))
+        self.write_schema(SCHEMA)
+        cwd = os.getcwd()
+        os.chdir(self.dir.name)
+        self.addCleanup(os.chdir, cwd)
+
+    def write_schema(self, source):
+        with open(os.path.join(self.dir.name, 'drizzle', 'schema.ts'), 'w') as f:
+            f.write(source)
+
+    def run_script(self, *args):
+        output = io.StringIO()
+        with mock.patch('sys.argv', ['generate-migration.py', *args]), redirect_stdout(output):
+            generate_migration.main()
+        return output.getvalue()
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_incremental_run_keeps_the_complete_migration(self):
+        self.run_script()
+        self.assertFalse(os.path.exists('supabase-rollback.incremental.sql'))
+        complete = self.read('supabase-rollback.sql')
+
+        self.write_schema(SCHEMA.replace('  createdAt: timestamp', '  lastSeenAt: timestamp("lastSeenAt"),\n  createdAt: timestamp'))
+        self.run_script()
+        rollback = self.read('supabase-rollback.sql')
+        self.assertIn('RENAME COLUMN last_seen_at TO lastSeenAt', rollback)
+        self.assertIn('RENAME COLUMN notes_text TO notesText', rollback)
+        self.assertLess(len(complete), len(rollback))
+        delta = self.read('supabase-rollback.incremental.sql')
+        self.assertIn('RENAME COLUMN last_seen_at TO lastSeenAt', delta)
+        self.assertNotIn('open_id', delta)
+
+        output = self.run_script()
+        self.assertIn('No schema changes', output)
+        self.assertEqual(self.read('supabase-rollback.incremental.sql'), delta)
+
+    def test_other_settings_regenerate_everything(self):
+        self.run_script()
+        output = self.run_script('--per-table')
+        self.assertNotIn('No schema changes', output)
+        self.assertFalse(os.path.exists('supabase-migration.incremental.sql'))
+        self.assertIn('-- MODE: one transaction per table', self.read('supabase-migration.sql'))
+        self.assertTrue(drizzle_schema.load_snapshot(SNAPSHOT)['settings']['per_table'])
+        self.assertIn('No schema changes', self.run_script('--per-table'))
+
+
+if __name__ == '__main__':
+    unittest.main()